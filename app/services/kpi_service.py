@@ -2,10 +2,13 @@
 Servicio de KPIs para Dashboard
 Calcula métricas críticas para contadores y administradores
 """
-from django.db.models import Sum, Count, Avg, F, Q
+from django.db.models import (
+    Sum, Count, Avg, F, Q, Case, CharField, ExpressionWrapper, FloatField, Value, When
+)
 from django.utils import timezone
 from datetime import timedelta
 from django.core.cache import cache
+import time
 
 
 class KPIService:
@@ -16,6 +19,42 @@ class KPIService:
     CACHE_TIMEOUT_MEDIUM = 60 * 30    # 30 min - Datos menos críticos
     CACHE_TIMEOUT_LONG = 60 * 60 * 2  # 2 horas - Datos históricos
     
+    # Prefijos de cache_page de las vistas de app/views/kpi_api.py
+    PAGE_CACHE_PREFIX_PRODUCTOS = 'kpi_productos'
+    PAGE_CACHE_PREFIX_ABC = 'kpi_abc'
+    
+    # Versión vigente de los KPIs cacheados; incrementarla invalida todos los KPIs
+    CACHE_VERSION_KEY = 'kpi:version'
+    
+    @staticmethod
+    def _cache_get(nombre):
+        """
+        Lee un KPI cacheado y la versión vigente en un solo get_many
+        
+        Cada entrada guarda (versión, valor) y solo es válida si su versión
+        es la vigente.
+        
+        Returns:
+            tuple: (clave, versión, valor o None si no hay entrada vigente)
+        """
+        cache_key = f'kpi:{nombre}'
+        encontrados = cache.get_many([KPIService.CACHE_VERSION_KEY, cache_key])
+        version = encontrados.get(KPIService.CACHE_VERSION_KEY)
+        if version is None:
+            # Versión expulsada o nunca creada: semilla que no repite versiones anteriores
+            cache.add(KPIService.CACHE_VERSION_KEY, time.time_ns(), None)
+            return cache_key, cache.get(KPIService.CACHE_VERSION_KEY), None
+        
+        entrada = encontrados.get(cache_key)
+        if entrada is not None and entrada[0] == version:
+            return cache_key, version, entrada[1]
+        return cache_key, version, None
+    
+    @staticmethod
+    def _cache_set(cache_key, version, value, timeout):
+        """Guarda un KPI junto con la versión con la que se calculó"""
+        cache.set(cache_key, (version, value), timeout)
+    
     @staticmethod
     def get_margen_bruto(dias=180):
         """
@@ -37,8 +76,7 @@ class KPIService:
         if dias not in [7, 30, 90, 180, 365]:
             dias = 180
         
-        cache_key = f'kpi:margen_bruto:dias:{dias}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'margen_bruto:dias:{dias}')
         if cached:
             return cached
         
@@ -49,8 +87,8 @@ class KPIService:
         
         # Ventas del periodo actual
         ventas_periodo = Sale.objects.filter(fecha__gte=fecha_limite).aggregate(
-            total=Sum('total')
-        )['total'] or 0
+            total=Sum('total', output_field=FloatField())
+        )['total'] or 0.0
         
         # Costo de ventas del periodo (desde SaleDetail)
         costo_periodo = SaleDetail.objects.filter(
@@ -58,18 +96,18 @@ class KPIService:
         ).annotate(
             costo_total=F('cantidad') * F('producto__precio_compra')
         ).aggregate(
-            total=Sum('costo_total')
-        )['total'] or 0
+            total=Sum('costo_total', output_field=FloatField())
+        )['total'] or 0.0
         
-        margen_periodo = float(ventas_periodo - costo_periodo)
+        margen_periodo = ventas_periodo - costo_periodo
         
         # Periodo anterior (para comparaci\u00f3n)
         ventas_anterior = Sale.objects.filter(
             fecha__gte=fecha_anterior,
             fecha__lt=fecha_limite
         ).aggregate(
-            total=Sum('total')
-        )['total'] or 0
+            total=Sum('total', output_field=FloatField())
+        )['total'] or 0.0
         
         costo_anterior = SaleDetail.objects.filter(
             venta__fecha__gte=fecha_anterior,
@@ -77,10 +115,10 @@ class KPIService:
         ).annotate(
             costo_total=F('cantidad') * F('producto__precio_compra')
         ).aggregate(
-            total=Sum('costo_total')
-        )['total'] or 0
+            total=Sum('costo_total', output_field=FloatField())
+        )['total'] or 0.0
         
-        margen_anterior = float(ventas_anterior - costo_anterior)
+        margen_anterior = ventas_anterior - costo_anterior
         
         # % de cambio (robustez para divisi\u00f3n por cero)
         if margen_anterior > 0:
@@ -97,7 +135,7 @@ class KPIService:
             'tendencia': 'up' if cambio_pct > 0 else 'down'
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_SHORT)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_SHORT)
         return result
     
     @staticmethod
@@ -119,8 +157,7 @@ class KPIService:
         if dias not in [7, 30, 90, 180, 365]:
             dias = 180
         
-        cache_key = f'kpi:ticket_promedio:dias:{dias}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'ticket_promedio:dias:{dias}')
         if cached:
             return cached
         
@@ -131,21 +168,21 @@ class KPIService:
         stats = Sale.objects.filter(
             fecha__gte=fecha_limite
         ).aggregate(
-            total=Sum('total'),
+            total=Sum('total', output_field=FloatField()),
             count=Count('id')
         )
         
         # ROBUSTEZ: Evita divisi\u00f3n por cero
         ventas_count = stats['count'] or 0
-        ventas_total = stats['total'] or 0
+        ventas_total = stats['total'] or 0.0
         ticket_promedio = (ventas_total / ventas_count) if ventas_count > 0 else 0.0
         
         result = {
-            'ticket_promedio': round(float(ticket_promedio), 2),
+            'ticket_promedio': round(ticket_promedio, 2),
             'cantidad_ventas': ventas_count
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_MEDIUM)
         return result
     
     @staticmethod
@@ -170,8 +207,7 @@ class KPIService:
         if dias not in [7, 30, 90, 180, 365]:
             dias = 180
        
-        cache_key = f'kpi:top_productos:dias:{dias}:limit:{limit}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'top_productos:dias:{dias}:limit:{limit}')
         if cached:
             return cached
         
@@ -185,7 +221,7 @@ class KPIService:
             'producto__nombre', 'producto__codigo'
         ).annotate(
             cantidad_total=Sum('cantidad'),
-            ingresos_total=Sum(F('precio_unitario') * F('cantidad'))
+            ingresos_total=Sum(F('precio_unitario') * F('cantidad'), output_field=FloatField())
         ).order_by('-cantidad_total')[:limit]
         
         result = []
@@ -194,10 +230,10 @@ class KPIService:
                 'nombre': p['producto__nombre'],
                 'codigo': p['producto__codigo'],
                 'cantidad': int(p['cantidad_total']),
-                'ingresos': round(float(p['ingresos_total']), 2)
+                'ingresos': round(p['ingresos_total'], 2)
             })
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_MEDIUM)
         return result
     
     @staticmethod
@@ -212,8 +248,7 @@ class KPIService:
                 'productos': list
             }
         """
-        cache_key = 'kpi:stock_bajo'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get('stock_bajo')
         if cached:
             return cached
         
@@ -233,7 +268,7 @@ class KPIService:
             'productos': list(productos[:10])  # Top 10 más urgentes
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_SHORT)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_SHORT)
         return result
     
     @staticmethod
@@ -256,8 +291,7 @@ class KPIService:
         if dias not in [7, 30, 90, 180, 365]:
             dias = 180
        
-        cache_key = f'kpi:ventas_evolucion:dias:{dias}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'ventas_evolucion:dias:{dias}')
         if cached:
             return cached
         
@@ -304,7 +338,7 @@ class KPIService:
             'total_periodo': round(total_general, 2)
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_MEDIUM)
         return result
     
     @staticmethod
@@ -327,8 +361,7 @@ class KPIService:
                 'total_neto': float
             }
         """
-        cache_key = f'kpi:flujo_caja:meses:{meses}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'flujo_caja:meses:{meses}')
         if cached:
             return cached
         
@@ -398,7 +431,7 @@ class KPIService:
             'total_neto': round(sum(flujo_neto), 2)
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_MEDIUM)
         return result
     
     @staticmethod
@@ -420,15 +453,12 @@ class KPIService:
                 'rotacion_anual': [8, 6, 12, ...]  # veces que rota por año
             }
         """
-        cache_key = f'kpi:rotacion_inventario:top:{top_n}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'rotacion_inventario:top:{top_n}')
         if cached:
             return cached
         
         from app.models.product import Product
         from app.models.sale import SaleDetail
-        from django.db.models import DecimalField
-        from django.db.models import ExpressionWrapper
         
         # 1. Costo de Inventario Actual por Categoría
         # = SUM(stock_actual * precio_compra) por categoría
@@ -440,7 +470,7 @@ class KPIService:
             costo_inventario=Sum(
                 ExpressionWrapper(
                     F('stock_actual') * F('precio_compra'),
-                    output_field=DecimalField(max_digits=10, decimal_places=2)
+                    output_field=FloatField()
                 )
             )
         ).filter(
@@ -459,7 +489,7 @@ class KPIService:
             costo_ventas=Sum(
                 ExpressionWrapper(
                     F('cantidad') * F('producto__precio_compra'),
-                    output_field=DecimalField(max_digits=10, decimal_places=2)
+                    output_field=FloatField()
                 )
             )
         )
@@ -467,12 +497,12 @@ class KPIService:
         # 3. Combinar datos y calcular Días de Inventario
         # Crear diccionarios para lookup
         inventario_dict = {
-            item['categoria__nombre']: float(item['costo_inventario'] or 0)
+            item['categoria__nombre']: item['costo_inventario'] or 0.0
             for item in inventario_por_categoria
         }
         
         ventas_dict = {
-            item['producto__categoria__nombre']: float(item['costo_ventas'] or 0)
+            item['producto__categoria__nombre']: item['costo_ventas'] or 0.0
             for item in ventas_por_categoria
         }
         
@@ -523,7 +553,7 @@ class KPIService:
             'categorias_count': len(labels)
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_MEDIUM)
         return result
     
     @staticmethod
@@ -549,8 +579,7 @@ class KPIService:
                 'alerta': 'alta'|'media'|'baja'  # Nivel de concentración
             }
         """
-        cache_key = f'kpi:concentracion_clientes:top:{top_n}:meses:{meses}'
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f'concentracion_clientes:top:{top_n}:meses:{meses}')
         if cached:
             return cached
         
@@ -640,25 +669,25 @@ class KPIService:
             'total_clientes': total_clientes
         }
         
-        cache.set(cache_key, result, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, result, KPIService.CACHE_TIMEOUT_MEDIUM)
         return result
     
     @staticmethod
     def clear_all_kpi_cache():
         """Invalida todos los cachés de KPIs (usar al finalizar día)"""
-        cache_keys = [
-            'kpi:margen_bruto:today',
-            'kpi:ticket_promedio:month',
-            'kpi:top_productos:week:3',
-            'kpi:stock_bajo',
-            'kpi:ventas_mes:evolucion',
-            'kpi:flujo_caja:meses:6',  # Fase 2.1
-            'kpi:rotacion_inventario:top:10',  # Fase 2.2
-            'kpi:concentracion_clientes:top:20:meses:6'  # Fase 2.3
-        ]
-        
-        for key in cache_keys:
-            cache.delete(key)
+        # Nueva versión: las entradas kpi:* de versiones anteriores dejan de ser
+        # válidas y se reescriben al recalcular. No vacía sesiones ni otras cachés.
+        try:
+            cache.incr(KPIService.CACHE_VERSION_KEY)
+        except ValueError:
+            # La versión expiró o nunca se creó: usar una nueva no reutilizada
+            cache.set(KPIService.CACHE_VERSION_KEY, time.time_ns(), None)
+        
+        # Respuestas cacheadas con cache_page (solo backends con delete_pattern, p. ej. django-redis).
+        # delete_pattern recorre el keyspace con SCAN: no llamar en rutas frecuentes
+        if hasattr(cache, 'delete_pattern'):
+            for prefix in (KPIService.PAGE_CACHE_PREFIX_PRODUCTOS, KPIService.PAGE_CACHE_PREFIX_ABC):
+                cache.delete_pattern(f'views.decorators.cache.cache_*.{prefix}.*')
     
     # ============================================================================
     # COMPONENTE 1: MÉTRICAS DE VENTAS (Análisis Financiero)
@@ -677,13 +706,11 @@ class KPIService:
         Returns:
             Lista con margen_porcentaje, ganancia_total, unidades_vendidas
         """
-        cache_key = f"kpi:rentabilidad:{dias}:{limit}"
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f"rentabilidad:{dias}:{limit}")
         if cached:
             return cached
         
         from app.models import SaleDetail
-        from django.db.models import DecimalField
         
         fecha_inicio = timezone.now() - timedelta(days=dias)
         
@@ -700,7 +727,7 @@ class KPIService:
                 total_vendido=Sum('cantidad'),
                 ganancia_total=Sum(
                     F('cantidad') * (F('precio_unitario') - F('producto__precio_compra')),
-                    output_field=DecimalField()
+                    output_field=FloatField()
                 )
             )
             .filter(ganancia_total__gt=0)
@@ -720,12 +747,12 @@ class KPIService:
             resultado.append({
                 'nombre': item['producto__nombre'],
                 'margen_porcentaje': round(margen_porcentaje, 2),
-                'ganancia_total': float(item['ganancia_total']),
+                'ganancia_total': item['ganancia_total'],
                 'unidades_vendidas': item['total_vendido'],
                 'precio_venta': precio_venta
             })
         
-        cache.set(cache_key, resultado, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, resultado, KPIService.CACHE_TIMEOUT_MEDIUM)
         return resultado
     
     @staticmethod
@@ -745,20 +772,19 @@ class KPIService:
                 'resumen': Dict con estadísticas por clase
             }
         """
-        cache_key = f"kpi:abc_analysis:{dias}"
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f"abc_analysis:{dias}")
         if cached:
             return cached
         
         from app.models import Product, SaleDetail
-        from django.db.models import DecimalField
         from django.db.models.functions import Coalesce
-        from decimal import Decimal
         
         fecha_inicio = timezone.now() - timedelta(days=dias)
         
+        # Solo las columnas que se serializan: evita traer descripción, FKs y campos DIAN
         productos = (
             Product.objects
+            .only('id', 'nombre', 'codigo')
             .filter(activo=True)
             .annotate(
                 ganancia_total=Coalesce(
@@ -766,16 +792,16 @@ class KPIService:
                         F('saledetail__cantidad') * 
                         (F('saledetail__precio_unitario') - F('precio_compra')),
                         filter=Q(saledetail__venta__fecha__gte=fecha_inicio),
-                        output_field=DecimalField()
+                        output_field=FloatField()
                     ),
-                    Decimal('0.00')
+                    0.0
                 )
             )
             .filter(ganancia_total__gt=0)
             .order_by('-ganancia_total')
         )
         
-        ganancia_total_general = sum(float(p.ganancia_total) for p in productos)
+        ganancia_total_general = sum(p.ganancia_total for p in productos)
         
         if ganancia_total_general == 0:
             return {
@@ -796,7 +822,7 @@ class KPIService:
         }
         
         for producto in productos:
-            ganancia = float(producto.ganancia_total)
+            ganancia = producto.ganancia_total
             acumulado += ganancia
             porcentaje_acumulado = (acumulado / ganancia_total_general) * 100
             
@@ -832,7 +858,7 @@ class KPIService:
             'resumen': resumen
         }
         
-        cache.set(cache_key, resultado, KPIService.CACHE_TIMEOUT_MEDIUM)
+        KPIService._cache_set(cache_key, version, resultado, KPIService.CACHE_TIMEOUT_MEDIUM)
         return resultado
     
     # ============================================================================
@@ -855,16 +881,16 @@ class KPIService:
         Returns:
             Lista con rotacion_dias, clasificacion, color, stock_actual
         """
-        cache_key = f"kpi:rotacion_inventario:{limit}"
-        cached = cache.get(cache_key)
+        cache_key, version, cached = KPIService._cache_get(f"rotacion_inventario:{limit}")
         if cached:
             return cached
         
-        from app.models import Product, SaleDetail
+        from app.models import Product
         from django.db.models.functions import Coalesce
         
         fecha_inicio = timezone.now() - timedelta(days=30)
         
+        # Rotación, clasificación, orden y límite se resuelven en una sola consulta
         productos_con_ventas = (
             Product.objects
             .filter(activo=True, stock_actual__gt=0)
@@ -875,37 +901,37 @@ class KPIService:
                 )
             )
             .filter(ventas_30d__gt=0)
+            .annotate(
+                # Stock / (ventas_30d / 30) = días que dura el stock actual
+                rotacion=ExpressionWrapper(
+                    F('stock_actual') * 30.0 / F('ventas_30d'),
+                    output_field=FloatField()
+                ),
+                clasificacion=Case(
+                    When(rotacion__lt=30, then=Value('Rápida')),
+                    When(rotacion__lt=60, then=Value('Media')),
+                    default=Value('Lenta'),
+                    output_field=CharField()
+                )
+            )
+            .order_by('rotacion')
+            .values('nombre', 'codigo', 'stock_actual', 'ventas_30d', 'rotacion', 'clasificacion')[:limit]
         )
         
-        resultado = []
-        for producto in productos_con_ventas:
-            ventas_diarias = producto.ventas_30d / 30.0
-            if ventas_diarias > 0:
-                rotacion_dias = int(producto.stock_actual / ventas_diarias)
-                
-                if rotacion_dias < 30:
-                    clasificacion = 'Rápida'
-                    color = 'success'
-                elif rotacion_dias < 60:
-                    clasificacion = 'Media'
-                    color = 'warning'
-                else:
-                    clasificacion = 'Lenta'
-                    color = 'danger'
-                
-                resultado.append({
-                    'nombre': producto.nombre,
-                    'codigo': producto.codigo,
-                    'rotacion_dias': rotacion_dias,
-                    'clasificacion': clasificacion,
-                    'color': color,
-                    'stock_actual': producto.stock_actual,
-                    'ventas_30d': producto.ventas_30d
-                })
-        
-        resultado.sort(key=lambda x: x['rotacion_dias'])
-        resultado = resultado[:limit]
-        
-        cache.set(cache_key, resultado, KPIService.CACHE_TIMEOUT_MEDIUM)
+        colores = {'Rápida': 'success', 'Media': 'warning', 'Lenta': 'danger'}
+        resultado = [
+            {
+                'nombre': producto['nombre'],
+                'codigo': producto['codigo'],
+                'rotacion_dias': int(producto['rotacion']),
+                'clasificacion': producto['clasificacion'],
+                'color': colores[producto['clasificacion']],
+                'stock_actual': producto['stock_actual'],
+                'ventas_30d': producto['ventas_30d']
+            }
+            for producto in productos_con_ventas
+        ]
+        
+        KPIService._cache_set(cache_key, version, resultado, KPIService.CACHE_TIMEOUT_MEDIUM)
         return resultado
 
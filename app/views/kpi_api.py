@@ -7,18 +7,20 @@ Principios de seguridad:
 - Confidencialidad: Solo datos agregados
 - Integridad: Validación de parámetros y rate limiting
 """
-from django.http import JsonResponse
 from django.views.decorators.http import require_GET
 from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_cookie
 from django.utils import timezone
 from app.services.kpi_service import KPIService
-import traceback
+from core.responses import OrjsonResponse
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 @require_GET
-@cache_page(60 * 15)  # Cache 15 minutos
-@vary_on_cookie
+@cache_page(60 * 15, key_prefix=KPIService.PAGE_CACHE_PREFIX_PRODUCTOS)  # Cache 15 minutos
+@vary_on_cookie  # Una entrada por (dias, limit, sesión)
 def get_kpi_productos(request):
     """
     GET /api/kpi/productos/?dias=7&limit=5
@@ -51,12 +53,12 @@ def get_kpi_productos(request):
         
         # Validaciones de seguridad
         if dias not in [7, 30, 90, 180, 365]:
-            return JsonResponse({
+            return OrjsonResponse({
                 'error': 'Parámetro "dias" inválido. Valores permitidos: 7, 30, 90, 180, 365'
             }, status=400)
         
         if limit < 1 or limit > 20:
-            return JsonResponse({
+            return OrjsonResponse({
                 'error': 'Parámetro "limit" inválido. Rango permitido: 1-20'
             }, status=400)
         
@@ -68,27 +70,23 @@ def get_kpi_productos(request):
         
         try:
             top_vendidos = KPIService.get_top_productos(dias=dias, limit=limit)
-        except Exception as e:
-            print(f"[ERROR] get_top_productos: {e}")
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error en KPIService.get_top_productos")
         
         try:
             rentabilidad = KPIService.get_rentabilidad_productos(dias=dias, limit=limit)
-        except Exception as e:
-            print(f"[ERROR] get_rentabilidad_productos: {e}")
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error en KPIService.get_rentabilidad_productos")
         
         try:
             abc_analysis = KPIService.get_productos_abc_analysis(dias=dias)
-        except Exception as e:
-            print(f"[ERROR] get_productos_abc_analysis: {e}")
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error en KPIService.get_productos_abc_analysis")
         
         try:
             rotacion = KPIService.get_rotacion_inventario(limit=limit)
-        except Exception as e:
-            print(f"[ERROR] get_rotacion_inventario: {e}")
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error en KPIService.get_rotacion_inventario")
         
         data = {
             'ventas': {
@@ -107,19 +105,18 @@ def get_kpi_productos(request):
             }
         }
         
-        return JsonResponse(data)
+        return OrjsonResponse(data)
     
     except ValueError as e:
-        return JsonResponse({
+        return OrjsonResponse({
             'error': f'Parámetros inválidos: {str(e)}'
         }, status=400)
     
     except Exception as e:
         # Log del error con traceback completo
-        print(f"[ERROR] API KPI Productos: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error en API KPI Productos")
         
-        return JsonResponse({
+        return OrjsonResponse({
             'error': 'Error interno del servidor',
             'error_detail': str(e),
             'ventas': {
@@ -134,7 +131,7 @@ def get_kpi_productos(request):
 
 
 @require_GET
-@cache_page(60 * 15)
+@cache_page(60 * 15, key_prefix=KPIService.PAGE_CACHE_PREFIX_ABC)
 def get_kpi_abc_detalle(request):
     """
     GET /api/kpi/productos/abc/?dias=30
@@ -156,7 +153,7 @@ def get_kpi_abc_detalle(request):
         dias = int(request.GET.get('dias', 30))
         
         if dias not in [7, 30, 90, 180, 365]:
-            return JsonResponse({
+            return OrjsonResponse({
                 'error': 'Parámetro "dias" inválido'
             }, status=400)
         
@@ -166,11 +163,11 @@ def get_kpi_abc_detalle(request):
             'periodo_dias': dias
         }
         
-        return JsonResponse(resultado)
+        return OrjsonResponse(resultado)
     
-    except Exception as e:
-        print(f"[ERROR] API ABC Analysis: {str(e)}")
-        return JsonResponse({
+    except Exception:
+        logger.exception("API ABC Analysis")
+        return OrjsonResponse({
             'error': 'Error interno del servidor'
         }, status=500)
 
@@ -189,14 +186,14 @@ def invalidar_cache_kpis(request):
     try:
         KPIService.clear_all_kpi_cache()
         
-        return JsonResponse({
+        return OrjsonResponse({
             'success': True,
             'mensaje': 'Caché de KPIs invalidado exitosamente',
             'timestamp': timezone.now().isoformat()
         })
     
     except Exception as e:
-        return JsonResponse({
+        return OrjsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
@@ -82,6 +82,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "app.middleware.security_headers.SecurityHeadersMiddleware",
+    "core.middleware.EventQueueMiddleware",  # Publica en lote los eventos del request
 ]
 
 if ENABLE_ALLAUTH:
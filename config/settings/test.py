@@ -3,6 +3,9 @@ Configuración para testing.
 Usa SQLite en memoria y caché local para tests rápidos sin dependencias externas.
 """
 
+import os
+import tempfile
+
 from .base import *
 
 # Testing
@@ -32,6 +35,11 @@ CACHES = {
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
 
+# Archivos generados por los tests (XML firmados, log de seguridad) fuera del repositorio
+TEST_OUTPUT_DIR = tempfile.mkdtemp(prefix="inventario-tests-")
+MEDIA_ROOT = os.path.join(TEST_OUTPUT_DIR, "media")
+LOGGING["handlers"]["security_hmac"]["filename"] = os.path.join(TEST_OUTPUT_DIR, "security.log")
+
 # Email backend para testing
 EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 
@@ -13,15 +13,22 @@ Integración segura con servicios existentes:
 """
 
 import logging
+import time
 from datetime import timedelta
 from decimal import Decimal
+from functools import cached_property
 from typing import Any, Dict, List, Optional
 
+from django.core.cache import cache
 from django.db.models import Avg, Count, F, Q, Sum
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+# Caché del dashboard consolidado
+DASHBOARD_CACHE_PREFIX = "core:dashboard"
+DASHBOARD_CACHE_VERSION_KEY = f"{DASHBOARD_CACHE_PREFIX}:version"
+DASHBOARD_CACHE_BUCKET = 30  # segundos por ventana de caché
 
 class DataAggregator:
     """
@@ -31,40 +38,103 @@ class DataAggregator:
     Usa try/except para manejar errores de módulos no disponibles.
     """
 
+    # Constructores de contexto RAG por intención: (self, hoy, limite) -> datos
+    _CONTEXT_BUILDERS = {
+        "VENTAS": lambda self, hoy, limite: self._contexto_ventas(hoy, limite),
+        "INVENTARIO": lambda self, hoy, limite: self._contexto_inventario(limite),
+        "FINANCIERO": lambda self, hoy, limite: self._contexto_financiero(hoy),
+        "PREDICCION": lambda self, hoy, limite: self._contexto_prediccion(hoy, limite),
+    }
+
     def __init__(self):
-        self._kpi_service = None
         self._cache_timeout = 300  # 5 minutos
 
-    @property
+    @cached_property
     def kpi_service(self):
-        """Obtiene KPIService existente de forma diferida"""
-        if self._kpi_service is None:
-            try:
-                from app.services.kpi_service import KPIService
+        """Obtiene KPIService existente de forma diferida (se resuelve una vez por instancia)"""
+        try:
+            from app.services.kpi_service import KPIService
 
-                self._kpi_service = KPIService
-            except ImportError:
-                logger.warning("KPIService no disponible")
-                self._kpi_service = None
-        return self._kpi_service
+            return KPIService
+        except ImportError:
+            logger.warning("KPIService no disponible")
+            return None
 
     def obtener_dashboard_completo(
-        self, fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None
+        self,
+        fecha_inicio: Optional[str] = None,
+        fecha_fin: Optional[str] = None,
+        bypass_cache: bool = False,
     ) -> Dict[str, Any]:
         """
         Obtiene datos consolidados para dashboard
 
         Integra con KPIService existente sin romper funcionalidad.
         En caso de error, retorna datos parciales en lugar de fallar.
+        El resultado se cachea por ventanas de 30 segundos; ventas, compras y
+        cambios de stock invalidan la caché (ver core/signals.py).
 
         Args:
             fecha_inicio: Fecha inicio en formato ISO (opcional)
             fecha_fin: Fecha fin en formato ISO (opcional)
+            bypass_cache: Si True, recalcula sin leer ni escribir caché
 
         Returns:
             dict: Dashboard consolidado con kpis, analytics, alertas, etc.
         """
-        # Parsear fechas o usar últimos 30 días
+        if bypass_cache:
+            return self._construir_dashboard(fecha_inicio, fecha_fin)
+
+        cache_key = self._dashboard_cache_key(fecha_inicio, fecha_fin)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        dashboard = self._construir_dashboard(fecha_inicio, fecha_fin)
+        # TTL algo mayor que la ventana para cubrir el cambio de bucket
+        cache.set(cache_key, dashboard, DASHBOARD_CACHE_BUCKET + 5)
+        return dashboard
+
+    @staticmethod
+    def _dashboard_cache_key(fecha_inicio: Optional[str], fecha_fin: Optional[str]) -> str:
+        """Clave por versión, rango solicitado y ventana de tiempo"""
+        version = cache.get_or_set(DASHBOARD_CACHE_VERSION_KEY, 1, None)
+        bucket = int(time.time() // DASHBOARD_CACHE_BUCKET)
+        return f"{DASHBOARD_CACHE_PREFIX}:v{version}:{fecha_inicio or ''}:{fecha_fin or ''}:{bucket}"
+
+    @staticmethod
+    def invalidate():
+        """
+        Invalida todos los dashboards cacheados
+
+        Incrementa la versión en lugar de borrar por patrón, así funciona
+        también con backends sin delete_pattern (LocMemCache en tests).
+        """
+        try:
+            cache.incr(DASHBOARD_CACHE_VERSION_KEY)
+        except ValueError:
+            # La versión expiró o nunca se creó: usar una nueva no reutilizada
+            cache.set(DASHBOARD_CACHE_VERSION_KEY, int(time.time()), None)
+
+    def _construir_dashboard(self, fecha_inicio: Optional[str], fecha_fin: Optional[str]) -> Dict[str, Any]:
+        """Genera el dashboard consolidado sin caché"""
+        fecha_inicio, fecha_fin = self._parsear_periodo(fecha_inicio, fecha_fin)
+
+        return self._ensamblar_dashboard(
+            fecha_inicio,
+            fecha_fin,
+            # 1. Obtener KPIs existentes (integración segura; vacío sin KPIService)
+            self._obtener_kpis_seguros(),
+            # 2. Obtener datos para Analytics (consulta los modelos, no requiere KPIService)
+            self._obtener_datos_analytics(fecha_inicio, fecha_fin),
+            # 3. Obtener alertas existentes
+            self._obtener_alertas_urgentes(),
+            modo_fallback=self.kpi_service is None,
+        )
+
+    @staticmethod
+    def _parsear_periodo(fecha_inicio: Optional[str], fecha_fin: Optional[str]):
+        """Parsea fechas ISO o usa los últimos 30 días"""
         if fecha_inicio:
             try:
                 from datetime import datetime
@@ -85,23 +155,29 @@ class DataAggregator:
         else:
             fecha_fin = timezone.now()
 
-        dashboard = {
-            "periodo": {
-                "inicio": fecha_inicio.isoformat() if hasattr(fecha_inicio, "isoformat") else str(fecha_inicio),
-                "fin": fecha_fin.isoformat() if hasattr(fecha_fin, "isoformat") else str(fecha_fin),
-                "generado": timezone.now().isoformat(),
-            },
-            "modo_fallback": False,
-        }
-
-        # 1. Obtener KPIs existentes (integración segura)
-        dashboard["kpis"] = self._obtener_kpis_seguros()
+        return fecha_inicio, fecha_fin
 
-        # 2. Obtener datos para Analytics
-        dashboard["analytics"] = self._obtener_datos_analytics(fecha_inicio, fecha_fin)
+    @staticmethod
+    def _periodo(fecha_inicio, fecha_fin) -> Dict[str, str]:
+        """Sección periodo del dashboard"""
+        return {
+            "inicio": fecha_inicio.isoformat() if hasattr(fecha_inicio, "isoformat") else str(fecha_inicio),
+            "fin": fecha_fin.isoformat() if hasattr(fecha_fin, "isoformat") else str(fecha_fin),
+            "generado": timezone.now().isoformat(),
+        }
 
-        # 3. Obtener alertas existentes
-        dashboard["alertas"] = self._obtener_alertas_urgentes()
+    @staticmethod
+    def _ensamblar_dashboard(
+        fecha_inicio, fecha_fin, kpis, analytics, alertas, modo_fallback: bool = False
+    ) -> Dict[str, Any]:
+        """Arma el dashboard a partir de sus secciones ya calculadas"""
+        dashboard = {
+            "periodo": DataAggregator._periodo(fecha_inicio, fecha_fin),
+            "modo_fallback": modo_fallback,
+            "kpis": kpis,
+            "analytics": analytics,
+            "alertas": alertas,
+        }
 
         # 4. Estadísticas de integración
         dashboard["estadisticas"] = {
@@ -299,32 +375,20 @@ class DataAggregator:
         Returns:
             dict: Contexto estructurado para enviar al LLM
         """
-        contexto = {"intencion": intencion, "timestamp": timezone.now().isoformat(), "datos": {}}
-
         hoy = timezone.now()
-
-        if intencion == "VENTAS":
-            contexto["datos"] = self._contexto_ventas(hoy, limite)
-
-        elif intencion == "INVENTARIO":
-            contexto["datos"] = self._contexto_inventario(limite)
-
-        elif intencion == "FINANCIERO":
-            contexto["datos"] = self._contexto_financiero(hoy)
-
-        elif intencion == "PREDICCION":
-            contexto["datos"] = self._contexto_prediccion(hoy, limite)
-
-        else:
-            # Contexto general
-            contexto["datos"] = {
-                "resumen_ventas": self._contexto_ventas(hoy, 3),
-                "resumen_inventario": self._contexto_inventario(3),
-            }
+        builder = self._CONTEXT_BUILDERS.get(intencion, DataAggregator._contexto_general)
+        contexto = {"intencion": intencion, "timestamp": hoy.isoformat(), "datos": builder(self, hoy, limite)}
 
         logger.debug(f"Contexto RAG generado para intención: {intencion}")
         return contexto
 
+    def _contexto_general(self, hoy: Any, limite: int) -> Dict[str, Any]:
+        """Contexto general para intenciones sin constructor propio"""
+        return {
+            "resumen_ventas": self._contexto_ventas(hoy, 3),
+            "resumen_inventario": self._contexto_inventario(3),
+        }
+
     def _contexto_ventas(self, fecha: Any, limite: int) -> Dict[str, Any]:
         """Contexto de ventas para RAG"""
         try:
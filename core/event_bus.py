@@ -10,84 +10,126 @@ Características:
 - Reconexión automática a Redis
 - Fallback a sistema en memoria si Redis no está disponible
 - Persistencia opcional de eventos para suscriptores tardíos
+- Despacho de suscriptores en un hilo de fondo (publish no espera a los handlers)
+
+Semántica de entrega en modo memoria: antes los suscriptores corrían en
+línea dentro de publish(); ahora publish() los encola y retorna, y se
+ejecutan después en el hilo de despacho. Quien necesite que el handler haya
+terminado al volver de publish() debe pasar sync=True (corre en el hilo
+actual, como antes).
+
+Orden de entrega: el despacho usa un único hilo, por lo que los callbacks
+se ejecutan en el mismo orden en que se publicaron los eventos (p. ej. el
+handler de VENTA_REGISTRADA corre antes que el de VENTA_ANULADA de la misma
+venta). Al terminar el proceso se esperan los callbacks aún encolados (atexit).
 """
 
+import atexit
+import functools
+import itertools
 import json
 import logging
+import os
+import sys
 import threading
+import time
 import uuid
-from datetime import datetime
-from typing import Callable, Dict, List, Any, Optional
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from typing import Callable, DefaultDict, List, Any, Optional, Tuple
 
 from django.conf import settings
+from django.db import close_old_connections
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+# Versión del sobre de eventos: 2 agrega 'v' y 'timestamp_ns' ('timestamp' sigue en ISO 8601)
+ENVELOPE_VERSION = 2
+
 
 # Tipos de eventos predefinidos
 class EventTypes:
-    """Constantes para tipos de eventos del sistema"""
+    """Constantes para tipos de eventos del sistema (internadas: claves de dict en cada publish)"""
     # Ventas
-    VENTA_REGISTRADA = 'VENTA_REGISTRADA'
-    VENTA_ANULADA = 'VENTA_ANULADA'
-    VENTA_MODIFICADA = 'VENTA_MODIFICADA'
+    VENTA_REGISTRADA = sys.intern('VENTA_REGISTRADA')
+    VENTA_ANULADA = sys.intern('VENTA_ANULADA')
+    VENTA_MODIFICADA = sys.intern('VENTA_MODIFICADA')
     
     # Inventario
-    INVENTARIO_ACTUALIZADO = 'INVENTARIO_ACTUALIZADO'
-    STOCK_BAJO_DETECTADO = 'STOCK_BAJO_DETECTADO'
-    PRODUCTO_CREADO = 'PRODUCTO_CREADO'
+    INVENTARIO_ACTUALIZADO = sys.intern('INVENTARIO_ACTUALIZADO')
+    STOCK_BAJO_DETECTADO = sys.intern('STOCK_BAJO_DETECTADO')
+    PRODUCTO_CREADO = sys.intern('PRODUCTO_CREADO')
     
     # Compras
-    COMPRA_REGISTRADA = 'COMPRA_REGISTRADA'
-    COMPRA_RECIBIDA = 'COMPRA_RECIBIDA'
+    COMPRA_REGISTRADA = sys.intern('COMPRA_REGISTRADA')
+    COMPRA_RECIBIDA = sys.intern('COMPRA_RECIBIDA')
     
     # Contabilidad
-    ASIENTO_CONTABLE_CREADO = 'ASIENTO_CONTABLE_CREADO'
-    CIERRE_PERIODO = 'CIERRE_PERIODO'
+    ASIENTO_CONTABLE_CREADO = sys.intern('ASIENTO_CONTABLE_CREADO')
+    CIERRE_PERIODO = sys.intern('CIERRE_PERIODO')
     
     # Analytics
-    ANOMALIA_DETECTADA = 'ANOMALIA_DETECTADA'
-    PREDICCION_GENERADA = 'PREDICCION_GENERADA'
+    ANOMALIA_DETECTADA = sys.intern('ANOMALIA_DETECTADA')
+    PREDICCION_GENERADA = sys.intern('PREDICCION_GENERADA')
     
     # Sistema
-    SISTEMA_INICIADO = 'SISTEMA_INICIADO'
-    ERROR_CRITICO = 'ERROR_CRITICO'
+    SISTEMA_INICIADO = sys.intern('SISTEMA_INICIADO')
+    ERROR_CRITICO = sys.intern('ERROR_CRITICO')
+    
+    # Conjunto de las constantes anteriores (listado en /api/core/eventos/)
+    ALL = frozenset(
+        value for name, value in list(locals().items())
+        if name.isupper() and isinstance(value, str)
+    )
 
 
 class EventBus:
     """
     Bus de eventos resiliente usando Redis Pub/Sub
     
-    Implementa patrón Singleton para uso global.
+    Implementa patrón Singleton para uso global: EventBus() siempre
+    retorna la instancia creada una vez por _singleton().
     Soporta fallback a sistema en memoria si Redis no está disponible.
     """
     
-    _instance = None
+    # Sin __dict__ por instancia: atributos fijos y acceso más rápido
+    __slots__ = (
+        'redis_url', 'redis_client', 'pubsub', 'subscribers', '_executor',
+        '_counter', '_id_prefix', '_listening', '_listener_thread',
+        '_enabled', '_force_memory',
+    )
+    
     _lock = threading.Lock()
     
+    # Un solo hilo de despacho: conserva el orden de publicación entre eventos
+    DISPATCH_WORKERS = 1
+    
     def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super().__new__(cls)
-                cls._instance._initialized = False
-            return cls._instance
+        return _singleton()
     
-    def __init__(self):
-        if self._initialized:
-            return
-        self._initialize()
-        self._initialized = True
+    @classmethod
+    def _create(cls) -> 'EventBus':
+        """Construye e inicializa la única instancia (ver _singleton)"""
+        instance = object.__new__(cls)
+        instance._initialize()
+        return instance
     
     def _initialize(self):
         """Inicializa conexión a Redis con reintentos"""
         self.redis_url = getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0')
         self.redis_client = None
         self.pubsub = None
-        self.subscribers: Dict[str, List[Callable]] = {}
+        # Copy-on-write: subscribe/unsubscribe reemplazan la tupla, publish solo la recorre
+        self.subscribers: DefaultDict[str, Tuple[Callable, ...]] = defaultdict(tuple)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # event_id = prefijo por proceso + contador (sin uuid4 por evento)
+        self._reiniciar_ids()
         self._listening = False
         self._listener_thread = None
         self._enabled = getattr(settings, 'EVENT_BUS_ENABLED', True)
+        self._force_memory = False
         
         if self._enabled:
             self._connect()
@@ -133,7 +175,7 @@ class EventBus:
             return
         
         # Si está forzado a memoria (para testing), no intentar reconectar
-        if getattr(self, '_force_memory', False):
+        if self._force_memory:
             return
             
         if self.redis_client is None:
@@ -145,7 +187,7 @@ class EventBus:
                 logger.warning("Conexión Redis perdida, reconectando...")
                 self._connect()
     
-    def publish(self, event_type: str, data: dict, persistent: bool = False) -> bool:
+    def publish(self, event_type: str, data: dict, persistent: bool = False, sync: bool = False) -> bool:
         """
         Publica un evento a todos los suscriptores
         
@@ -153,6 +195,12 @@ class EventBus:
             event_type: Tipo de evento (usar EventTypes.*)
             data: Datos del evento
             persistent: Si True, guarda en cache para suscriptores tardíos
+            sync: Si True, en modo memoria ejecuta los suscriptores en el hilo actual;
+                si False (default) se encolan en el hilo de despacho y publish no los espera
+            
+        Los suscriptores reciben {'v', 'type', 'data', 'timestamp',
+        'timestamp_ns', 'event_id'}: timestamp sigue siendo ISO 8601 y
+        timestamp_ns (versión 2 del sobre) es el epoch en nanosegundos.
             
         Returns:
             bool: True si el evento fue publicado exitosamente
@@ -163,11 +211,14 @@ class EventBus:
         
         self._ensure_connection()
         
+        timestamp, timestamp_ns = self._marca_tiempo()
         event_data = {
+            'v': ENVELOPE_VERSION,
             'type': event_type,
             'data': data,
-            'timestamp': timezone.now().isoformat(),
-            'event_id': str(uuid.uuid4())
+            'timestamp': timestamp,
+            'timestamp_ns': timestamp_ns,
+            'event_id': self._next_event_id()
         }
         
         success = False
@@ -188,14 +239,80 @@ class EventBus:
                 
             else:
                 # Fallback a sistema en memoria
-                self._dispatch_to_subscribers(event_type, event_data)
+                self._dispatch_to_subscribers(event_type, event_data, sync=sync)
                 success = True
                 
         except Exception as e:
             logger.error(f"❌ Error publicando evento {event_type}: {e}")
         
         return success
-    
+
+    def publish_many(self, event_type: str, payloads: List[dict], persistent: bool = False,
+                     sync: bool = False) -> int:
+        """
+        Publica un lote de eventos del mismo tipo
+
+        Comparte un único timestamp para todo el lote y, con Redis,
+        envía las publicaciones en un solo pipeline.
+
+        Args:
+            event_type: Tipo de evento (usar EventTypes.*)
+            payloads: Lista de datos, uno por evento
+            persistent: Si True, guarda el último evento del lote para suscriptores tardíos
+            sync: Si True, en modo memoria ejecuta los suscriptores en el hilo actual
+
+        Returns:
+            int: Número de eventos publicados
+        """
+        if not self._enabled:
+            logger.debug(f"EventBus deshabilitado, ignorando lote: {event_type}")
+            return 0
+
+        if not payloads:
+            return 0
+
+        self._ensure_connection()
+
+        timestamp, timestamp_ns = self._marca_tiempo()
+
+        try:
+            if self.redis_client:
+                channel = f'event:{event_type}'
+                pipe = self.redis_client.pipeline(transaction=False)
+                for data in payloads:
+                    event_data = {
+                        'v': ENVELOPE_VERSION,
+                        'type': event_type,
+                        'data': data,
+                        'timestamp': timestamp,
+                        'timestamp_ns': timestamp_ns,
+                        'event_id': self._next_event_id()
+                    }
+                    pipe.publish(channel, json.dumps(event_data))
+                if persistent:
+                    pipe.setex(f'last_event:{event_type}', 3600, json.dumps(event_data))
+                pipe.execute()
+            else:
+                # Fallback a sistema en memoria: una sola lectura de suscriptores
+                callbacks = self.subscribers.get(event_type, ())
+                for data in payloads:
+                    event_data = {
+                        'v': ENVELOPE_VERSION,
+                        'type': event_type,
+                        'data': data,
+                        'timestamp': timestamp,
+                        'timestamp_ns': timestamp_ns,
+                        'event_id': self._next_event_id()
+                    }
+                    self._run_callbacks(callbacks, event_data, sync)
+
+            logger.debug(f"📤 Lote publicado: {event_type} ({len(payloads)} eventos)")
+            return len(payloads)
+
+        except Exception as e:
+            logger.error(f"❌ Error publicando lote {event_type}: {e}")
+            return 0
+
     def subscribe(self, event_type: str, callback: Callable, persistent: bool = False):
         """
         Suscribe una función a un tipo de evento
@@ -205,10 +322,8 @@ class EventBus:
             callback: Función que recibe (event_data: dict)
             persistent: Si True, procesa último evento guardado
         """
-        if event_type not in self.subscribers:
-            self.subscribers[event_type] = []
-        
-        self.subscribers[event_type].append(callback)
+        with self._lock:
+            self.subscribers[sys.intern(event_type)] += (callback,)
         logger.debug(f"📥 Suscrito a evento: {event_type} ({len(self.subscribers[event_type])} suscriptores)")
         
         # Si hay Redis y es persistente, procesar último evento
@@ -228,9 +343,14 @@ class EventBus:
     
     def unsubscribe(self, event_type: str, callback: Callable):
         """Cancela suscripción de un callback"""
-        if event_type in self.subscribers and callback in self.subscribers[event_type]:
-            self.subscribers[event_type].remove(callback)
-            logger.debug(f"🚫 Desuscrito de evento: {event_type}")
+        with self._lock:
+            callbacks = self.subscribers.get(event_type, ())
+            if callback not in callbacks:
+                return
+            restantes = list(callbacks)
+            restantes.remove(callback)
+            self.subscribers[event_type] = tuple(restantes)
+        logger.debug(f"🚫 Desuscrito de evento: {event_type}")
     
     def _start_listener(self):
         """Inicia hilo para escuchar eventos de Redis"""
@@ -247,7 +367,8 @@ class EventBus:
                     if message['type'] == 'pmessage':
                         try:
                             event_data = json.loads(message['data'])
-                            event_type = event_data.get('type', '')
+                            # Internar el tipo decodificado para reusar el hash de la clave
+                            event_type = sys.intern(event_data.get('type', ''))
                             self._dispatch_to_subscribers(event_type, event_data)
                         except json.JSONDecodeError as e:
                             logger.error(f"Error decodificando mensaje: {e}")
@@ -262,11 +383,67 @@ class EventBus:
         self._listening = True
         logger.info("🎧 Listener de eventos iniciado")
     
-    def _dispatch_to_subscribers(self, event_type: str, event_data: dict):
+    @staticmethod
+    def _marca_tiempo() -> Tuple[str, int]:
+        """Instante del evento como ISO 8601 (UTC) y epoch en nanosegundos"""
+        ns = time.time_ns()
+        return datetime.fromtimestamp(ns / 1e9, tz=dt_timezone.utc).isoformat(), ns
+    
+    def _reiniciar_ids(self):
+        """
+        Regenera el prefijo de event_id y reinicia el contador
+        
+        El prefijo combina un token aleatorio (distingue contenedores con el
+        mismo PID) y el PID. Se llama al crear el bus y en el hijo tras un
+        fork (ver _despues_de_fork al final del módulo).
+        """
+        self._id_prefix = f"{uuid.uuid4().hex[:8]}-{os.getpid()}"
+        self._counter = itertools.count()
+    
+    def _next_event_id(self) -> str:
+        """Genera un id único de evento: '<prefijo del proceso>-<contador>'"""
+        return f"{self._id_prefix}-{next(self._counter)}"
+    
+    def _dispatch_to_subscribers(self, event_type: str, event_data: dict, sync: bool = False):
         """Envía evento a todos los suscriptores registrados"""
-        if event_type in self.subscribers:
-            for callback in self.subscribers[event_type]:
+        self._run_callbacks(self.subscribers.get(event_type, ()), event_data, sync)
+    
+    def _run_callbacks(self, callbacks: Tuple[Callable, ...], event_data: dict, sync: bool):
+        """Ejecuta los callbacks en línea (sync) o los encola en el pool de hilos"""
+        if not callbacks:
+            return
+        if sync:
+            for callback in callbacks:
                 self._safe_callback(callback, event_data)
+            return
+        executor = self._get_executor()
+        for callback in callbacks:
+            executor.submit(self._callback_en_pool, callback, event_data)
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Crea el pool de forma diferida (seguro tras fork de workers)"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.DISPATCH_WORKERS,
+                        thread_name_prefix="EventBusDispatch"
+                    )
+        return self._executor
+    
+    def _cerrar_despacho(self):
+        """Espera los callbacks encolados y libera el hilo de despacho"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+    
+    def _callback_en_pool(self, callback: Callable, event_data: dict):
+        """Ejecuta el callback en el hilo de despacho y libera su conexión a BD"""
+        try:
+            self._safe_callback(callback, event_data)
+        finally:
+            # El hilo no pasa por request_started/finished: cerrar conexiones como Django
+            close_old_connections()
     
     def _safe_callback(self, callback: Callable, event_data: dict):
         """Ejecuta callback de forma segura sin propagar excepciones"""
@@ -296,7 +473,9 @@ class EventBus:
         Args:
             use_memory: Si True, usa modo memoria (sin Redis)
         """
-        self.subscribers = {}
+        # Esperar callbacks pendientes para que no se crucen con el siguiente test
+        self._cerrar_despacho()
+        self.subscribers = defaultdict(tuple)
         self._listening = False
         self._force_memory = use_memory  # Prevenir reconexión automática
         if use_memory:
@@ -327,5 +506,31 @@ class EventBus:
         }
 
 
+@functools.cache
+def _singleton() -> EventBus:
+    """Instancia única del EventBus; se crea en el primer EventBus()"""
+    return EventBus._create()
+
+
 # Singleton global para fácil acceso
 event_bus = EventBus()
+
+def _despues_de_fork():
+    """
+    Prepara el EventBus del proceso hijo tras un fork (workers de gunicorn)
+    
+    El hijo no debe repetir los event_id del padre, y no hereda el hilo de
+    despacho: un executor copiado aceptaría submit() sin ejecutar nada.
+    El lock se recrea por si el padre lo tenía tomado al hacer fork.
+    """
+    EventBus._lock = threading.Lock()
+    bus = _singleton()
+    bus._executor = None
+    bus._reiniciar_ids()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_despues_de_fork)
+
+# Al salir del proceso no se pierden los eventos aún encolados
+atexit.register(lambda: _singleton()._cerrar_despacho())
@@ -1,5 +1,6 @@
 """Core middleware package."""
 
+from .event_queue import EventQueueMiddleware
 from .permissions_policy import PermissionsPolicyMiddleware
 
-__all__ = ["PermissionsPolicyMiddleware"]
+__all__ = ["EventQueueMiddleware", "PermissionsPolicyMiddleware"]
@@ -0,0 +1,24 @@
+"""
+Event Queue Middleware - Publicación en lote de eventos del request.
+
+Abre la cola de eventos de core.signals alrededor de la vista para que los
+eventos generados en el request se publiquen juntos al terminar.
+"""
+
+from core.signals import cola_eventos
+
+
+class EventQueueMiddleware:
+    """
+    Middleware que agrupa los eventos del EventBus publicados durante el request.
+
+    La cola vive en un ContextVar y se cierra en un bloque finally, de modo
+    que se publica y se descarta aunque la vista lance una excepción.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with cola_eventos():
+            return self.get_response(request)
@@ -0,0 +1,76 @@
+"""
+Respuestas HTTP JSON serializadas con orjson
+
+orjson serializa los dicts anidados del dashboard/KPIs varias veces más
+rápido que json.dumps. Si la librería no está instalada se usa el mismo
+encoder que JsonResponse (DjangoJSONEncoder), por lo que el contrato de
+salida no cambia.
+"""
+
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Model
+from django.forms.models import model_to_dict
+from django.http import HttpResponse
+from django.utils.functional import Promise
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def orjson_default(obj):
+    """
+    Tipos que orjson no serializa de forma nativa
+
+    Público para reutilizarlo como enc_hook de otros encoders (core.schemas).
+    """
+    if isinstance(obj, Decimal):
+        # Mismo formato que DjangoJSONEncoder
+        return str(obj)
+    if isinstance(obj, Promise):
+        return str(obj)
+    if isinstance(obj, Model):
+        return model_to_dict(obj)
+    # Fechas (OPT_PASSTHROUGH_DATETIME), timedelta, etc.: mismo formato que
+    # JsonResponse (milisegundos y "Z" para UTC). Lanza TypeError si no aplica.
+    return _django_encoder.default(obj)
+
+
+class _FallbackEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder + instancias de modelo, para cuando falta orjson"""
+
+    def default(self, o):
+        if isinstance(o, Model):
+            return model_to_dict(o)
+        return super().default(o)
+
+
+def dumps(data) -> bytes:
+    """Serializa a JSON (bytes) con orjson o, si no está, con DjangoJSONEncoder"""
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=orjson_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+    return json.dumps(data, cls=_FallbackEncoder).encode('utf-8')
+
+
+class OrjsonResponse(HttpResponse):
+    """
+    Reemplazo directo de JsonResponse para endpoints con payloads grandes
+
+    Uso:
+        return OrjsonResponse({'ok': True}, status=200)
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,94 @@
+"""
+Esquemas de respuesta de la API Core
+
+Con msgspec instalado las respuestas son msgspec.Struct: la forma se valida
+al construirlas (sección faltante -> TypeError; las sobrantes se descartan
+para no convertir el endpoint en un 500) y se codifican directo a JSON sin
+pasar por dicts intermedios. Sin msgspec se usan
+dataclasses equivalentes y la serialización de core.responses.
+"""
+
+import logging
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, List
+
+from core.responses import dumps, orjson_default
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - depende del entorno
+    msgspec = None
+
+
+if msgspec is not None:
+
+    class Periodo(msgspec.Struct):
+        """Rango de fechas del dashboard"""
+
+        inicio: str
+        fin: str
+        generado: str
+
+    class DashboardResponse(msgspec.Struct):
+        """Respuesta de GET /api/core/dashboard/"""
+
+        periodo: Periodo
+        modo_fallback: bool
+        kpis: Dict[str, Any]
+        analytics: Dict[str, Any]
+        alertas: List[Dict[str, Any]]
+        estadisticas: Dict[str, Any]
+
+    _CAMPOS_DASHBOARD = frozenset(DashboardResponse.__struct_fields__)
+
+    _encoder = msgspec.json.Encoder(enc_hook=orjson_default)
+
+    def encode(response) -> bytes:
+        """Serializa un esquema a JSON (bytes)"""
+        return _encoder.encode(response)
+
+else:  # pragma: no cover - depende del entorno
+
+    @dataclass
+    class Periodo:
+        """Rango de fechas del dashboard"""
+
+        inicio: str
+        fin: str
+        generado: str
+
+    @dataclass
+    class DashboardResponse:
+        """Respuesta de GET /api/core/dashboard/"""
+
+        periodo: Periodo
+        modo_fallback: bool
+        kpis: Dict[str, Any]
+        analytics: Dict[str, Any]
+        alertas: List[Dict[str, Any]]
+        estadisticas: Dict[str, Any]
+
+    _CAMPOS_DASHBOARD = frozenset(campo.name for campo in fields(DashboardResponse))
+
+    def encode(response) -> bytes:
+        """Serializa un esquema a JSON (bytes)"""
+        return dumps(asdict(response))
+
+
+def dashboard_response(dashboard: Dict[str, Any]) -> DashboardResponse:
+    """
+    Construye DashboardResponse desde el dict de DataAggregator
+
+    Las claves que el esquema no declara se descartan (con aviso en el log).
+
+    Raises:
+        TypeError: si falta alguna sección del dashboard
+    """
+    campos = {clave: valor for clave, valor in dashboard.items() if clave in _CAMPOS_DASHBOARD}
+    if len(campos) != len(dashboard):
+        logger.warning(f"Secciones del dashboard fuera del esquema: {sorted(set(dashboard) - _CAMPOS_DASHBOARD)}")
+    if isinstance(campos.get('periodo'), dict):
+        campos['periodo'] = Periodo(**campos['periodo'])
+    return DashboardResponse(**campos)
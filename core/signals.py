@@ -6,24 +6,42 @@ solo agregan eventos para los nuevos módulos (Contabilidad, Analytics, IA).
 
 En caso de error, las excepciones NO se propagan para no romper
 el flujo existente del sistema.
+
+Durante un request HTTP (core.middleware.EventQueueMiddleware) los eventos
+se encolan y se publican juntos al terminar la vista: N ventas guardadas en
+un mismo request generan un solo pipeline a Redis en lugar de N round-trips.
+Fuera de un request (shell, comandos, tareas) se publican de inmediato.
 """
 
 import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import groupby
 
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+# Cola de eventos del request en curso; None fuera de un request.
+# ContextVar (no threading.local) para aislar requests concurrentes bajo ASGI.
+_cola_eventos: ContextVar = ContextVar("cola_eventos", default=None)
+
 
 def _safe_publish_event(event_type: str, data: dict, persistent: bool = False):
     """
     Publica evento de forma segura sin propagar excepciones
 
     Esta función existe para garantizar que el sistema existente
-    no se vea afectado por errores en el EventBus.
+    no se vea afectado por errores en el EventBus. Dentro de un
+    request solo encola el evento (ver cola_eventos).
     """
+    pending = _cola_eventos.get()
+    if pending is not None:
+        pending.append((event_type, data, persistent))
+        return
+
     try:
         from core.event_bus import EventTypes, event_bus
 
@@ -38,6 +56,57 @@ def _safe_publish_event(event_type: str, data: dict, persistent: bool = False):
         logger.error(f"⚠️  Error publicando evento {event_type}: {e}")
 
 
+def _flush_eventos(pending):
+    """Publica eventos encolados agrupando los consecutivos del mismo tipo en un lote"""
+    try:
+        from core.event_bus import event_bus
+
+        for (event_type, persistent), grupo in groupby(pending, key=lambda e: (e[0], e[2])):
+            event_bus.publish_many(event_type, [data for _, data, _ in grupo], persistent=persistent)
+        logger.debug(f"✅ {len(pending)} eventos del request publicados")
+
+    except ImportError:
+        logger.debug("EventBus no disponible, ignorando eventos")
+    except Exception as e:
+        # NUNCA propagar excepciones - No romper flujo existente
+        logger.error(f"⚠️  Error publicando eventos del request: {e}")
+
+
+@contextmanager
+def cola_eventos():
+    """
+    Encola los eventos publicados dentro del bloque y los publica en lote al salir
+
+    La cola se descarta siempre en el finally, aunque la vista lance una
+    excepción, así ningún evento queda pendiente para el siguiente request.
+    """
+    token = _cola_eventos.set([])
+    try:
+        yield
+    finally:
+        pending = _cola_eventos.get()
+        _cola_eventos.reset(token)
+        if pending:
+            _flush_eventos(pending)
+
+
+def _invalidar_dashboard():
+    """
+    Invalida el dashboard cacheado del DataAggregator sin propagar errores
+
+    Solo se llama ante ventas, compras y cambios de stock de un producto.
+    Otros cambios (descripción, precio, alertas nuevas) se reflejan al
+    expirar la ventana de 30 segundos de la caché, así las ediciones
+    masivas no invalidan el dashboard en cada save.
+    """
+    try:
+        from core.data_integration import DataAggregator
+
+        DataAggregator.invalidate()
+    except Exception as e:
+        logger.error(f"⚠️  Error invalidando caché del dashboard: {e}")
+
+
 # =============================================================================
 # Señales para Ventas
 # =============================================================================
@@ -73,6 +142,7 @@ def publicar_evento_venta(sender, instance, created, **kwargs):
             estado = getattr(instance, "estado", "COMPLETADA")
             if estado in ["COMPLETADA", "PAGADA"]:
                 _safe_publish_event(EventTypes.VENTA_REGISTRADA, event_data, persistent=True)
+                _invalidar_dashboard()
                 logger.info(f"📤 Evento VENTA_REGISTRADA para venta #{instance.id}")
 
         else:
@@ -86,6 +156,7 @@ def publicar_evento_venta(sender, instance, created, **kwargs):
                     "fecha_anulacion": timezone.now().isoformat(),
                 }
                 _safe_publish_event(EventTypes.VENTA_ANULADA, event_data)
+                _invalidar_dashboard()
                 logger.info(f"📤 Evento VENTA_ANULADA para venta #{instance.id}")
 
     except Exception as e:
@@ -98,6 +169,28 @@ def publicar_evento_venta(sender, instance, created, **kwargs):
 # =============================================================================
 
 
+# Campos del producto que afectan al dashboard (stock bajo, estadísticas de inventario)
+_CAMPOS_STOCK = ("stock_actual", "stock_minimo")
+
+
+def _stock_producto(instance):
+    """Valores de stock cargados en la instancia (sin disparar consultas por campos diferidos)"""
+    return tuple(instance.__dict__.get(campo) for campo in _CAMPOS_STOCK)
+
+
+@receiver(post_init, sender="app.Product")
+def _recordar_stock_producto(sender, instance, **kwargs):
+    """Recuerda el stock con el que se cargó el producto para detectar cambios al guardar"""
+    instance._stock_cargado = _stock_producto(instance)
+
+
+def _stock_cambio(instance, update_fields) -> bool:
+    """True si el save modificó el stock respecto al valor cargado"""
+    if update_fields is not None and not set(update_fields) & set(_CAMPOS_STOCK):
+        return False
+    return _stock_producto(instance) != getattr(instance, "_stock_cargado", None)
+
+
 @receiver(post_save, sender="app.Product")
 def publicar_evento_producto(sender, instance, created, **kwargs):
     """
@@ -110,6 +203,11 @@ def publicar_evento_producto(sender, instance, created, **kwargs):
     try:
         from core.event_bus import EventTypes
 
+        # El dashboard incluye productos con stock bajo: solo invalidar si cambió el stock
+        if _stock_cambio(instance, kwargs.get("update_fields")):
+            _invalidar_dashboard()
+        instance._stock_cargado = _stock_producto(instance)
+
         if created:
             event_data = {
                 "producto_id": instance.id,
@@ -162,6 +260,7 @@ def publicar_evento_compra(sender, instance, created, **kwargs):
                 "fecha": instance.fecha.isoformat() if hasattr(instance, "fecha") else timezone.now().isoformat(),
             }
             _safe_publish_event(EventTypes.COMPRA_REGISTRADA, event_data)
+            _invalidar_dashboard()
 
     except Exception as e:
         logger.error(f"Error en señal de compra: {e}")
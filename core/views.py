@@ -3,10 +3,13 @@ Core Views - Endpoints para monitoreo y debugging del módulo Core
 """
 
 import logging
-from django.http import JsonResponse
+from django.http import HttpResponse
 from django.views.decorators.http import require_GET
 from django.utils import timezone
 
+from core.responses import OrjsonResponse
+from core.schemas import dashboard_response, encode
+
 logger = logging.getLogger(__name__)
 
 
@@ -48,11 +51,11 @@ def health_check(request):
         }
         
         status_code = 200 if all_healthy else 500
-        return JsonResponse(response, status=status_code)
+        return OrjsonResponse(response, status=status_code)
         
     except Exception as e:
         logger.error(f"Error en health check: {e}")
-        return JsonResponse({
+        return OrjsonResponse({
             'status': 'error',
             'error': str(e),
             'timestamp': timezone.now().isoformat()
@@ -77,12 +80,9 @@ def list_event_types(request):
         stats = event_bus.get_stats()
         
         # Listar todos los tipos de eventos definidos
-        all_event_types = [
-            attr for attr in dir(EventTypes) 
-            if not attr.startswith('_') and isinstance(getattr(EventTypes, attr), str)
-        ]
+        all_event_types = sorted(EventTypes.ALL)
         
-        return JsonResponse({
+        return OrjsonResponse({
             'event_types_defined': all_event_types,
             'event_types_with_subscribers': list(stats['subscribers'].keys()),
             'statistics': stats,
@@ -91,7 +91,7 @@ def list_event_types(request):
         
     except Exception as e:
         logger.error(f"Error listando eventos: {e}")
-        return JsonResponse({
+        return OrjsonResponse({
             'error': str(e)
         }, status=500)
 
@@ -124,11 +124,12 @@ def get_dashboard(request):
             fecha_fin=fecha_fin
         )
         
-        return JsonResponse(dashboard)
+        # El esquema valida las secciones antes de responder
+        return HttpResponse(encode(dashboard_response(dashboard)), content_type='application/json')
         
     except Exception as e:
         logger.error(f"Error generando dashboard: {e}")
-        return JsonResponse({
+        return OrjsonResponse({
             'error': 'No se pudo generar el dashboard',
             'detail': str(e),
             'modo_fallback': True
@@ -163,11 +164,11 @@ def get_context_for_ai(request):
             limite=min(limite, 20)  # Limitar máximo
         )
         
-        return JsonResponse(contexto)
+        return OrjsonResponse(contexto)
         
     except Exception as e:
         logger.error(f"Error obteniendo contexto IA: {e}")
-        return JsonResponse({
+        return OrjsonResponse({
             'error': str(e),
             'intencion': request.GET.get('intencion', 'GENERAL')
         }, status=500)
@@ -188,7 +189,7 @@ def publish_test_event(request):
     from django.conf import settings
     
     if not settings.DEBUG:
-        return JsonResponse({
+        return OrjsonResponse({
             'error': 'Endpoint solo disponible en modo DEBUG'
         }, status=403)
     
@@ -203,14 +204,14 @@ def publish_test_event(request):
         
         success = event_bus.publish(EventTypes.SISTEMA_INICIADO, test_data)
         
-        return JsonResponse({
+        return OrjsonResponse({
             'success': success,
             'mensaje': 'Evento de prueba publicado',
             'event_data': test_data
         })
         
     except Exception as e:
-        return JsonResponse({
+        return OrjsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
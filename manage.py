@@ -5,6 +5,9 @@ import sys
 if __name__ == '__main__':
     import dotenv
     dotenv.load_dotenv()
+    # `manage.py test` usa los settings de la suite (SQLite en memoria, hasher MD5)
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.test')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
     try:
         from django.core.management import execute_from_command_line
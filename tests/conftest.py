@@ -0,0 +1,23 @@
+"""
+Configuración compartida de pytest para la suite de tests.
+
+pytest-django ya ejecuta django.setup() una vez por sesión (y por worker con
+-n auto); aquí solo se agrega la inicialización única que falta.
+"""
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def event_bus_sin_reintentos():
+    """
+    Fija el EventBus en modo memoria una sola vez si Redis no respondió al importar.
+
+    Sin esto cada post_save (Product, Sale, ...) reintenta la conexión a Redis
+    con esperas de 1, 2 y 4 segundos. Se conservan los suscriptores
+    registrados por las apps en ready().
+    """
+    from core.event_bus import event_bus
+
+    if event_bus.redis_client is None:
+        event_bus._force_memory = True
+    yield
@@ -0,0 +1,77 @@
+"""
+Tests unitarios para los permisos DRF del módulo fiscal.
+"""
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import RequestFactory
+from app.fiscal.models import PerfilFiscal
+from app.fiscal.permissions import FiscalDataPermission
+
+
+pytestmark = [pytest.mark.django_db, pytest.mark.unit]
+
+
+@pytest.fixture
+def superuser():
+    """Fixture que crea un superusuario"""
+    return get_user_model().objects.create_superuser(
+        username='fiscal_admin',
+        email='admin@fiscal.com',
+        password='AdminPass123!'
+    )
+
+
+@pytest.fixture
+def viewer_user():
+    """Fixture que crea un usuario con permiso fiscal.view_fiscal_data"""
+    user = get_user_model().objects.create_user(
+        username='fiscal_viewer',
+        email='viewer@fiscal.com',
+        password='ViewerPass123!'
+    )
+    permission, _ = Permission.objects.get_or_create(
+        codename='view_fiscal_data',
+        content_type=ContentType.objects.get_for_model(PerfilFiscal),
+        defaults={'name': 'Puede ver datos fiscales'}
+    )
+    user.user_permissions.add(permission)
+    return user
+
+
+class TestFiscalDataPermission:
+    """Tests para FiscalDataPermission"""
+
+    @pytest.mark.parametrize('verb', ['get', 'post', 'delete'])
+    def test_superuser_all_verbs(self, verb, superuser):
+        """Test: Superusuario tiene acceso con cualquier método HTTP"""
+        request = getattr(RequestFactory(), verb)('/api/fiscal/')
+        request.user = superuser
+
+        assert FiscalDataPermission().has_permission(request, None)
+
+    def test_anonymous_user_denied(self):
+        """Test: Usuario anónimo no tiene acceso"""
+        request = RequestFactory().get('/api/fiscal/')
+        request.user = AnonymousUser()
+
+        assert not FiscalDataPermission().has_permission(request, None)
+
+    def test_user_with_view_permission(self, viewer_user, django_assert_num_queries):
+        """Test: Permiso de lectura se consulta una sola vez por request"""
+        request = RequestFactory().get('/api/fiscal/')
+        request.user = viewer_user
+        permission = FiscalDataPermission()
+
+        # Solo la primera llamada consulta permisos (usuario + grupos)
+        with django_assert_num_queries(2):
+            assert permission.has_permission(request, None)
+            assert permission.has_permission(request, None)
+
+    def test_user_without_permission_cannot_post(self, viewer_user):
+        """Test: Permiso de lectura no habilita escritura"""
+        request = RequestFactory().post('/api/fiscal/')
+        request.user = viewer_user
+
+        assert not FiscalDataPermission().has_permission(request, None)
@@ -0,0 +1,26 @@
+"""
+Utilidades compartidas para tests de endpoints JSON.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+
+class JSONAssertionsMixin:
+    """Parseo de respuestas JSON y verificación de claves en una sola aserción"""
+
+    def _parse(self, response):
+        """Decodifica el cuerpo JSON de la respuesta (normal o streaming)"""
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        return orjson.loads(content) if orjson is not None else json.loads(content)
+
+    def assertKeys(self, data, required):
+        """Verifica que data contiene todas las claves requeridas"""
+        faltantes = set(required) - data.keys()
+        self.assertFalse(faltantes, f"Faltan claves: {sorted(faltantes)}")
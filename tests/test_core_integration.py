@@ -8,13 +8,19 @@ Verifica que:
 """
 
 import json
-from unittest.mock import patch, MagicMock
+import time
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import call, patch, MagicMock
+
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
+from tests.mixins import JSONAssertionsMixin
+
 
-class EventBusTestCase(TestCase):
+class EventBusTestCase(JSONAssertionsMixin, TestCase):
     """Tests para el bus de eventos"""
     
     def setUp(self):
@@ -31,6 +37,8 @@ class EventBusTestCase(TestCase):
         bus1 = self.EventBus()
         bus2 = self.EventBus()
         self.assertIs(bus1, bus2)
+        # Estado en __slots__, sin __dict__ por instancia
+        self.assertFalse(hasattr(bus1, '__dict__'))
     
     def test_subscriber_receives_event_in_memory(self):
         """Verifica que suscriptores reciben eventos (modo memoria)"""
@@ -44,13 +52,41 @@ class EventBusTestCase(TestCase):
         
         # Publicar evento
         test_data = {'test': 'data', 'value': 123}
-        self.event_bus.publish(self.EventTypes.SISTEMA_INICIADO, test_data)
+        self.event_bus.publish(self.EventTypes.SISTEMA_INICIADO, test_data, sync=True)
         
         # Verificar que callback recibió evento
         self.assertEqual(len(received_events), 1)
         self.assertEqual(received_events[0]['data']['test'], 'data')
         self.assertEqual(received_events[0]['data']['value'], 123)
     
+    def test_despacho_en_hilo_conserva_orden_de_publicacion(self):
+        """Verifica que el despacho asíncrono entrega en el orden publicado"""
+        recibidos = []
+        self.event_bus.subscribe('TEST_EVENT', lambda e: recibidos.append(e['data']['n']))
+    
+        for n in range(20):
+            self.event_bus.publish('TEST_EVENT', {'n': n})
+        # El reinicio espera a que el hilo de despacho termine lo pendiente
+        self.event_bus._reset_for_testing(use_memory=True)
+    
+        self.assertEqual(recibidos, list(range(20)))
+    
+    def test_cerrar_despacho_ejecuta_callbacks_encolados(self):
+        """Verifica que al cerrar el despacho (atexit) no se pierden eventos encolados"""
+        recibidos = []
+        
+        def lento(evento):
+            time.sleep(0.05)
+            recibidos.append(evento['data']['n'])
+        
+        self.event_bus.subscribe('TEST_EVENT', lento)
+        self.event_bus.publish('TEST_EVENT', {'n': 1})
+        self.event_bus.publish('TEST_EVENT', {'n': 2})
+        self.event_bus._cerrar_despacho()
+        
+        self.assertEqual(recibidos, [1, 2])
+        self.assertIsNone(self.event_bus._executor)
+    
     def test_publish_returns_success_flag(self):
         """Verifica que publish retorna True/False"""
         result = self.event_bus.publish('TEST_EVENT', {'key': 'value'})
@@ -64,15 +100,29 @@ class EventBusTestCase(TestCase):
             received_events.append(event_data)
         
         self.event_bus.subscribe('TEST_EVENT', callback)
-        self.event_bus.publish('TEST_EVENT', {'key': 'value'})
+        self.event_bus.publish('TEST_EVENT', {'key': 'value'}, sync=True)
         
         event = received_events[0]
         
         # Verificar estructura
-        self.assertIn('type', event)
-        self.assertIn('data', event)
-        self.assertIn('timestamp', event)
-        self.assertIn('event_id', event)
+        self.assertKeys(event, {'type', 'data', 'timestamp', 'event_id'})
+    
+    def test_event_envelope_timestamp_ns_e_ids_unicos(self):
+        """Verifica sobre v2: timestamp ISO, timestamp_ns e ids de evento distintos"""
+        received_events = []
+        self.event_bus.subscribe('TEST_EVENT', received_events.append)
+        
+        antes = time.time_ns()
+        self.event_bus.publish('TEST_EVENT', {'n': 1}, sync=True)
+        self.event_bus.publish_many('TEST_EVENT', [{'n': 2}, {'n': 3}], sync=True)
+        
+        evento = received_events[0]
+        self.assertEqual(evento['v'], 2)
+        self.assertIsInstance(evento['timestamp'], str)
+        self.assertIsNotNone(datetime.fromisoformat(evento['timestamp']).tzinfo)
+        self.assertGreaterEqual(evento['timestamp_ns'], antes)
+        ids = [e['event_id'] for e in received_events]
+        self.assertEqual(len(set(ids)), 3)
     
     def test_event_types_constants(self):
         """Verifica que constantes de eventos están definidas"""
@@ -80,30 +130,45 @@ class EventBusTestCase(TestCase):
         self.assertEqual(self.EventTypes.STOCK_BAJO_DETECTADO, 'STOCK_BAJO_DETECTADO')
         self.assertEqual(self.EventTypes.ANOMALIA_DETECTADA, 'ANOMALIA_DETECTADA')
     
+    def test_event_types_all_contiene_constantes(self):
+        """Verifica que EventTypes.ALL reúne todas las constantes definidas"""
+        self.assertIsInstance(self.EventTypes.ALL, frozenset)
+        self.assertIn(self.EventTypes.VENTA_REGISTRADA, self.EventTypes.ALL)
+        self.assertIn(self.EventTypes.ERROR_CRITICO, self.EventTypes.ALL)
+        self.assertNotIn('TEST_EVENT', self.EventTypes.ALL)
+        self.assertEqual(len(self.EventTypes.ALL), 14)
+    
+    def test_subscribe_registra_tipo_internado(self):
+        """Verifica que un tipo construido en runtime comparte la clave de la constante"""
+        tipo_dinamico = ''.join(['VENTA_', 'REGISTRADA'])
+        self.event_bus.subscribe(tipo_dinamico, lambda e: None)
+        
+        clave = next(iter(self.event_bus.subscribers))
+        self.assertIs(clave, self.EventTypes.VENTA_REGISTRADA)
+        # Tipos sin suscriptores no fallan ni requieren inicialización previa
+        self.assertEqual(self.event_bus.subscribers['SIN_SUSCRIPTORES'], ())
+    
     def test_health_check_method(self):
         """Verifica método health_check del EventBus"""
         health = self.event_bus.health_check()
         
-        self.assertIn('status', health)
-        self.assertIn('redis', health)
-        self.assertIn('timestamp', health)
+        self.assertKeys(health, {'status', 'redis', 'timestamp'})
     
     def test_get_stats_method(self):
         """Verifica método get_stats del EventBus"""
         stats = self.event_bus.get_stats()
         
-        self.assertIn('enabled', stats)
-        self.assertIn('redis_connected', stats)
-        self.assertIn('subscribers', stats)
-        self.assertIn('total_event_types', stats)
+        self.assertKeys(stats, {'enabled', 'redis_connected', 'subscribers', 'total_event_types'})
 
 
-class DataAggregatorTestCase(TestCase):
+class DataAggregatorTestCase(JSONAssertionsMixin, TestCase):
     """Tests para el agregador de datos"""
     
     def setUp(self):
         from core.data_integration import DataAggregator
         self.aggregator = DataAggregator()
+        # Sin dashboards cacheados por tests anteriores
+        DataAggregator.invalidate()
     
     def test_dashboard_completo_returns_dict(self):
         """Verifica que obtener_dashboard_completo retorna dict"""
@@ -115,27 +180,33 @@ class DataAggregatorTestCase(TestCase):
         """Verifica estructura del dashboard"""
         dashboard = self.aggregator.obtener_dashboard_completo()
         
-        self.assertIn('kpis', dashboard)
-        self.assertIn('analytics', dashboard)
-        self.assertIn('alertas', dashboard)
-        self.assertIn('periodo', dashboard)
-        self.assertIn('estadisticas', dashboard)
+        self.assertKeys(dashboard, {'kpis', 'analytics', 'alertas', 'periodo', 'estadisticas'})
     
     def test_dashboard_periodo_structure(self):
         """Verifica estructura del período"""
         dashboard = self.aggregator.obtener_dashboard_completo()
         
-        self.assertIn('inicio', dashboard['periodo'])
-        self.assertIn('fin', dashboard['periodo'])
-        self.assertIn('generado', dashboard['periodo'])
+        self.assertKeys(dashboard['periodo'], {'inicio', 'fin', 'generado'})
+    
+    def test_dashboard_cacheado_hasta_invalidar(self):
+        """Verifica que el dashboard se cachea y que invalidate() lo descarta"""
+        primero = self.aggregator.obtener_dashboard_completo()
+        
+        with self.assertNumQueries(0):
+            segundo = self.aggregator.obtener_dashboard_completo()
+        self.assertEqual(primero, segundo)
+        
+        self.aggregator.invalidate()
+        tercero = self.aggregator.obtener_dashboard_completo()
+        self.assertIsNot(tercero, segundo)
+        self.assertNotEqual(tercero['periodo']['generado'], segundo['periodo']['generado'])
     
     def test_contexto_para_consulta_ventas(self):
         """Verifica generación de contexto para RAG (ventas)"""
         contexto = self.aggregator.obtener_contexto_para_consulta('VENTAS')
         
         self.assertEqual(contexto['intencion'], 'VENTAS')
-        self.assertIn('datos', contexto)
-        self.assertIn('timestamp', contexto)
+        self.assertKeys(contexto, {'datos', 'timestamp'})
     
     def test_contexto_para_consulta_inventario(self):
         """Verifica generación de contexto para RAG (inventario)"""
@@ -144,27 +215,56 @@ class DataAggregatorTestCase(TestCase):
         self.assertEqual(contexto['intencion'], 'INVENTARIO')
         self.assertIn('datos', contexto)
     
+    def test_kpi_service_se_resuelve_una_vez(self):
+        """Verifica que kpi_service se cachea en la instancia"""
+        from app.services.kpi_service import KPIService
+        
+        self.assertIs(self.aggregator.kpi_service, KPIService)
+        self.assertIs(self.aggregator.__dict__['kpi_service'], KPIService)
+    
+    def test_contexto_para_consulta_despacha_por_intencion(self):
+        """Verifica que cada intención usa su constructor y el resto el contexto general"""
+        with patch.object(self.aggregator, '_contexto_financiero', return_value={'f': 1}) as mock_fin:
+            contexto = self.aggregator.obtener_contexto_para_consulta('FINANCIERO')
+        mock_fin.assert_called_once()
+        self.assertEqual(contexto['datos'], {'f': 1})
+        
+        general = self.aggregator.obtener_contexto_para_consulta('OTRA')
+        self.assertKeys(general['datos'], {'resumen_ventas', 'resumen_inventario'})
+    
     def test_health_check_method(self):
         """Verifica método health_check del DataAggregator"""
         health = self.aggregator.health_check()
         
-        self.assertIn('status', health)
-        self.assertIn('checks', health)
-        self.assertIn('timestamp', health)
+        self.assertKeys(health, {'status', 'checks', 'timestamp'})
     
     @patch('core.data_integration.DataAggregator.kpi_service', None)
     def test_dashboard_fallback_without_kpi_service(self):
         """Verifica fallback cuando KPIService no está disponible"""
-        dashboard = self.aggregator.obtener_dashboard_completo()
+        from core.data_integration import DataAggregator
+        analytics = {'ventas_periodo': {'total': 5.0}}
+        alertas = [{'id': 1}]
         
-        # Debe retornar dict vacío para KPIs pero no fallar
-        self.assertIsInstance(dashboard['kpis'], dict)
+        with patch.object(DataAggregator, '_obtener_datos_analytics', return_value=analytics), \
+                patch.object(DataAggregator, '_obtener_alertas_urgentes', return_value=alertas):
+            dashboard = self.aggregator.obtener_dashboard_completo(bypass_cache=True)
+        
+        # Solo la sección de KPIs queda vacía; analytics y alertas se siguen sirviendo
+        self.assertEqual(dashboard['kpis'], {})
+        self.assertTrue(dashboard['modo_fallback'])
+        self.assertKeys(dashboard, {'kpis', 'analytics', 'alertas', 'periodo', 'estadisticas'})
+        self.assertEqual(dashboard['analytics'], analytics)
+        self.assertEqual(dashboard['alertas'], alertas)
+        self.assertEqual(dashboard['estadisticas']['ventas_periodo'], 5.0)
 
 
-class CoreAPIEndpointsTestCase(TestCase):
+class CoreAPIEndpointsTestCase(JSONAssertionsMixin, TestCase):
     """Tests para endpoints de API del módulo Core"""
     
     def setUp(self):
+        from core.data_integration import DataAggregator
+        # Sin dashboards cacheados por tests anteriores
+        DataAggregator.invalidate()
         self.client = Client()
     
     def test_health_check_endpoint(self):
@@ -174,9 +274,8 @@ class CoreAPIEndpointsTestCase(TestCase):
         # Puede ser 200 (healthy) o 500 (degraded)
         self.assertIn(response.status_code, [200, 500])
         
-        data = json.loads(response.content)
-        self.assertIn('status', data)
-        self.assertIn('timestamp', data)
+        data = self._parse(response)
+        self.assertKeys(data, {'status', 'timestamp'})
     
     def test_event_types_endpoint(self):
         """Verifica endpoint /api/core/eventos/"""
@@ -184,9 +283,8 @@ class CoreAPIEndpointsTestCase(TestCase):
         
         self.assertEqual(response.status_code, 200)
         
-        data = json.loads(response.content)
-        self.assertIn('event_types_defined', data)
-        self.assertIn('statistics', data)
+        data = self._parse(response)
+        self.assertKeys(data, {'event_types_defined', 'statistics'})
     
     def test_dashboard_endpoint(self):
         """Verifica endpoint /api/core/dashboard/"""
@@ -195,20 +293,64 @@ class CoreAPIEndpointsTestCase(TestCase):
         # Puede ser 200 o 500 dependiendo de la DB
         self.assertIn(response.status_code, [200, 500])
         
-        data = json.loads(response.content)
+        data = self._parse(response)
         # Debe tener estructura de dashboard o error
         self.assertTrue('kpis' in data or 'error' in data)
     
+    def test_dashboard_response_valida_secciones(self):
+        """Verifica que el esquema del dashboard rechaza secciones faltantes y descarta las sobrantes"""
+        from core.schemas import dashboard_response, encode
+        
+        dashboard = {
+            'periodo': {'inicio': 'a', 'fin': 'b', 'generado': 'c'},
+            'modo_fallback': False,
+            'kpis': {},
+            'analytics': {},
+            'alertas': [],
+            'estadisticas': {'total_kpis': 0},
+        }
+        
+        self.assertEqual(json.loads(encode(dashboard_response(dashboard))), dashboard)
+        self.assertEqual(json.loads(encode(dashboard_response({**dashboard, 'extra': 1}))), dashboard)
+        
+        del dashboard['alertas']
+        with self.assertRaises(TypeError):
+            dashboard_response(dashboard)
+    
     def test_contexto_ia_endpoint(self):
         """Verifica endpoint /api/core/contexto-ia/"""
         response = self.client.get('/api/core/contexto-ia/?intencion=VENTAS')
         
         self.assertIn(response.status_code, [200, 500])
         
-        data = json.loads(response.content)
+        data = self._parse(response)
         if response.status_code == 200:
-            self.assertIn('intencion', data)
-            self.assertIn('datos', data)
+            self.assertKeys(data, {'intencion', 'datos'})
+    
+    def test_orjson_response_serializa_decimal_como_json_response(self):
+        """Verifica que OrjsonResponse mantiene el formato de JsonResponse"""
+        from core.responses import OrjsonResponse
+        
+        response = OrjsonResponse({'total': Decimal('10.50'), 1: 'clave int'}, status=201)
+        
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(self._parse(response), {'total': '10.50', '1': 'clave int'})
+    
+    def test_orjson_response_serializa_fechas_como_json_response(self):
+        """Verifica que las fechas conservan el formato de DjangoJSONEncoder (ms y 'Z')"""
+        from datetime import timezone as dt_timezone
+        from django.http import JsonResponse
+        from core.responses import OrjsonResponse
+        
+        data = {
+            'utc': datetime(2024, 5, 1, 12, 30, 45, 123456, tzinfo=dt_timezone.utc),
+            'naive': datetime(2024, 5, 1, 12, 30, 45, 123456),
+            'dia': datetime(2024, 5, 1).date(),
+        }
+        
+        self.assertEqual(json.loads(OrjsonResponse(data).content), json.loads(JsonResponse(data).content))
+        self.assertEqual(json.loads(OrjsonResponse(data).content)['utc'], '2024-05-01T12:30:45.123Z')
 
 
 class IntegrationWithExistingCodeTestCase(TestCase):
@@ -295,7 +437,7 @@ class IntegrationWithExistingCodeTestCase(TestCase):
         # Debe poder publicar y recibir eventos en memoria
         received = []
         event_bus.subscribe('TEST', lambda x: received.append(x))
-        event_bus.publish('TEST', {'key': 'value'})
+        event_bus.publish('TEST', {'key': 'value'}, sync=True)
         
         self.assertEqual(len(received), 1)
 
@@ -314,3 +456,66 @@ class SignalsIntegrationTestCase(TestCase):
             _safe_publish_event('INVALID', None)  # type: ignore
         except Exception as e:
             self.fail(f"_safe_publish_event lanzó excepción: {e}")
+    
+    def test_solo_cambios_de_stock_invalidan_dashboard(self):
+        """Verifica que editar un producto sin tocar el stock conserva el dashboard cacheado"""
+        from app.models import Product
+        from django.core.cache import cache
+        from core.data_integration import DASHBOARD_CACHE_VERSION_KEY
+        
+        producto = Product.objects.create(
+            codigo='DASH-001', nombre='Producto dashboard', stock_actual=5,
+            precio_compra=Decimal('1.00'), precio_venta=Decimal('2.00')
+        )
+        version = cache.get_or_set(DASHBOARD_CACHE_VERSION_KEY, 1, None)
+        
+        producto = Product.objects.get(pk=producto.pk)
+        producto.nombre = 'Producto renombrado'
+        producto.precio_venta = Decimal('3.00')
+        producto.save()
+        self.assertEqual(cache.get(DASHBOARD_CACHE_VERSION_KEY), version)
+        
+        producto.stock_actual = 1
+        producto.save(update_fields=['stock_actual'])
+        self.assertNotEqual(cache.get(DASHBOARD_CACHE_VERSION_KEY), version)
+    
+    def test_eventos_del_request_se_publican_en_lote_al_finalizar(self):
+        """Verifica que dentro de un request los eventos se encolan y se publican al terminar"""
+        from core import signals
+        from core.event_bus import EventBus
+        
+        # EventBus usa __slots__: se parchea la clase, no la instancia
+        with patch.object(EventBus, 'publish') as mock_publish, \
+                patch.object(EventBus, 'publish_many') as mock_many:
+            with signals.cola_eventos():
+                signals._safe_publish_event('VENTA_REGISTRADA', {'venta_id': 1}, persistent=True)
+                signals._safe_publish_event('VENTA_REGISTRADA', {'venta_id': 2}, persistent=True)
+                signals._safe_publish_event('PRODUCTO_CREADO', {'producto_id': 3})
+                mock_many.assert_not_called()
+            
+            mock_publish.assert_not_called()
+            self.assertEqual(mock_many.call_args_list, [
+                call('VENTA_REGISTRADA', [{'venta_id': 1}, {'venta_id': 2}], persistent=True),
+                call('PRODUCTO_CREADO', [{'producto_id': 3}], persistent=False),
+            ])
+            
+            # Fuera de un request se publica de inmediato
+            signals._safe_publish_event('PRODUCTO_CREADO', {'producto_id': 4})
+            mock_publish.assert_called_once_with('PRODUCTO_CREADO', {'producto_id': 4}, persistent=False)
+    
+    def test_cola_eventos_se_descarta_si_la_vista_falla(self):
+        """Verifica que una excepción en el request publica lo encolado y cierra la cola"""
+        from core import signals
+        from core.event_bus import EventBus
+        from core.middleware import EventQueueMiddleware
+        
+        def vista_con_error(request):
+            signals._safe_publish_event('VENTA_REGISTRADA', {'venta_id': 1})
+            raise RuntimeError('fallo en la vista')
+        
+        with patch.object(EventBus, 'publish_many') as mock_many:
+            with self.assertRaises(RuntimeError):
+                EventQueueMiddleware(vista_con_error)(request=None)
+            
+            mock_many.assert_called_once_with('VENTA_REGISTRADA', [{'venta_id': 1}], persistent=False)
+            self.assertIsNone(signals._cola_eventos.get())
@@ -3,7 +3,6 @@ Tests unitarios para el servicio de KPIs.
 Cubre métodos de KPIService y endpoints de API.
 """
 
-import json
 from decimal import Decimal
 from datetime import timedelta
 from unittest.mock import patch, MagicMock
@@ -14,14 +13,27 @@ from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 from app.services.kpi_service import KPIService
+from tests.mixins import JSONAssertionsMixin
 
 
 class KPIServiceTestCase(TestCase):
     """Tests para KPIService - Lógica de negocio de KPIs"""
     
+    NUM_PRODUCTOS = 50
+    NUM_VENTAS = 200
+    
     @classmethod
     def setUpTestData(cls):
-        """Configurar datos de prueba una vez para toda la clase"""
+        """
+        Configurar datos de prueba una vez para toda la clase
+        
+        50 productos (costo 1, venta 2) y 200 ventas de 1 unidad en las últimas
+        200 horas: cada producto vende 4 unidades en 30 días. El stock del
+        producto i es 2*(i+1), así que su rotación es 15*(i+1) días.
+        bulk_create evita las señales de venta (descuento de stock y eventos).
+        """
+        from app.models import Client as Cliente, Product, Sale, SaleDetail
+        
         # Crear usuario de prueba
         User = get_user_model()
         cls.user = User.objects.create_user(
@@ -29,13 +41,37 @@ class KPIServiceTestCase(TestCase):
             email='test@example.com',
             password='testpass123'
         )
+        cliente = Cliente.objects.create(nombre='Cliente KPI')
+        
+        productos = Product.objects.bulk_create([
+            Product(
+                codigo=f'KPI-{i:03d}', nombre=f'Producto KPI {i:03d}', stock_actual=2 * (i + 1),
+                precio_compra=Decimal('1.00'), precio_venta=Decimal('2.00')
+            )
+            for i in range(cls.NUM_PRODUCTOS)
+        ])
+        
+        ahora = timezone.now()
+        ventas = Sale.objects.bulk_create([
+            Sale(
+                numero_factura=f'KPI-{i:04d}', cliente=cliente, usuario=cls.user,
+                fecha=ahora - timedelta(hours=i), total=Decimal('2.00')
+            )
+            for i in range(cls.NUM_VENTAS)
+        ])
+        SaleDetail.objects.bulk_create([
+            SaleDetail(
+                venta=venta, producto=productos[i % cls.NUM_PRODUCTOS], cantidad=1,
+                precio_unitario=Decimal('2.00'), iva_tasa=Decimal('0.00'),
+                subtotal_sin_iva=Decimal('2.00'), iva_valor=Decimal('0.00'), subtotal=Decimal('2.00')
+            )
+            for i, venta in enumerate(ventas)
+        ])
     
     def setUp(self):
-        """Configurar cliente y limpiar caché antes de cada test"""
-        self.client = Client()
-        # Limpiar caché de KPIs
-        from django.core.cache import cache
-        cache.clear()
+        """Limpiar caché de KPIs antes de cada test"""
+        # KPIService cachea por claves fijas: sin limpiar se leerían resultados de otra clase
+        KPIService.clear_all_kpi_cache()
     
     # =========================================================================
     # Tests de Margen Bruto
@@ -59,8 +95,9 @@ class KPIServiceTestCase(TestCase):
         """Test: get_margen_bruto valida parámetro dias"""
         # Periodos válidos
         for dias in [7, 30, 90, 180, 365]:
-            result = KPIService.get_margen_bruto(dias=dias)
-            self.assertIsInstance(result, dict)
+            with self.subTest(dias=dias):
+                result = KPIService.get_margen_bruto(dias=dias)
+                self.assertIsInstance(result, dict)
         
         # Periodo inválido debe usar default (180)
         result = KPIService.get_margen_bruto(dias=999)
@@ -111,8 +148,9 @@ class KPIServiceTestCase(TestCase):
     def test_get_top_productos_respects_limit(self):
         """Test: get_top_productos respeta parámetro limit"""
         for limit in [1, 3, 5, 10]:
-            result = KPIService.get_top_productos(limit=limit)
-            self.assertLessEqual(len(result), limit)
+            with self.subTest(limit=limit):
+                result = KPIService.get_top_productos(limit=limit)
+                self.assertLessEqual(len(result), limit)
     
     # =========================================================================
     # Tests de Stock Bajo
@@ -208,9 +246,65 @@ class KPIServiceTestCase(TestCase):
         for producto in result:
             self.assertIn(producto['clasificacion'], valid_classifications)
             self.assertIn(producto['color'], valid_colors)
+    
+    def test_get_rotacion_inventario_single_query_ordered(self):
+        """Test: get_rotacion_inventario clasifica, ordena y limita en una consulta"""
+        # stock * 30 / ventas_30d = 2*(i+1) * 30 / 4 = 15*(i+1) días
+        with self.assertNumQueries(1):
+            result = KPIService.get_rotacion_inventario(limit=4)
+        
+        self.assertEqual(
+            [(p['codigo'], p['rotacion_dias'], p['clasificacion'], p['color']) for p in result],
+            [
+                ('KPI-000', 15, 'Rápida', 'success'),
+                ('KPI-001', 30, 'Media', 'warning'),
+                ('KPI-002', 45, 'Media', 'warning'),
+                ('KPI-003', 60, 'Lenta', 'danger'),
+            ]
+        )
+    
+    def test_kpis_con_ventas_retornan_float(self):
+        """Test: Los montos de KPIs salen como float nativo, no Decimal"""
+        margen = KPIService.get_margen_bruto(dias=30)
+        self.assertEqual(margen['margen_periodo'], 200.0)  # 400 vendidos - 200 de costo
+        
+        top = KPIService.get_top_productos(dias=30, limit=2)
+        rentabilidad = KPIService.get_rentabilidad_productos(dias=30, limit=2)
+        abc = KPIService.get_productos_abc_analysis(dias=30)
+        
+        for valor in (
+            margen['margen_periodo'],
+            KPIService.get_ticket_promedio(dias=30)['ticket_promedio'],
+            top[0]['ingresos'],
+            rentabilidad[0]['ganancia_total'],
+            abc['productos'][0]['ganancia_total'],
+        ):
+            self.assertIs(type(valor), float)
+    
+    def test_abc_analysis_carga_solo_columnas_necesarias(self):
+        """Test: El análisis ABC usa una consulta sin columnas que no serializa"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as ctx:
+            result = KPIService.get_productos_abc_analysis(dias=30)
+        
+        self.assertEqual(len(result['productos']), self.NUM_PRODUCTOS)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        sql = ctx.captured_queries[0]['sql']
+        for columna in ('descripcion', 'stock_actual', 'codigo_dian'):
+            self.assertNotIn(columna, sql)
+    
+    def test_productos_kpis_single_query(self):
+        """Test: top y rentabilidad de productos se resuelven con una consulta cada uno"""
+        with self.assertNumQueries(1):
+            KPIService.get_top_productos(dias=365, limit=5)
+        
+        with self.assertNumQueries(1):
+            KPIService.get_rentabilidad_productos(dias=365, limit=5)
 
 
-class KPIAPITestCase(TestCase):
+class KPIAPITestCase(JSONAssertionsMixin, TestCase):
     """Tests para API endpoints de KPIs"""
     
     @classmethod
@@ -225,12 +319,11 @@ class KPIAPITestCase(TestCase):
     
     def setUp(self):
         """Configurar cliente y autenticar"""
+        # Solo claves kpi:*; las respuestas cacheadas varían por la cookie de la nueva sesión
+        KPIService.clear_all_kpi_cache()
+        
         self.client = Client()
         self.client.login(username='apiuser', password='apipass123')
-        
-        # Limpiar caché
-        from django.core.cache import cache
-        cache.clear()
     
     # =========================================================================
     # Tests de Endpoint /api/kpi/productos/
@@ -247,33 +340,30 @@ class KPIAPITestCase(TestCase):
         
         self.assertEqual(response['Content-Type'], 'application/json')
         
-        data = json.loads(response.content)
+        data = self._parse(response)
         self.assertIsInstance(data, dict)
     
     def test_api_kpi_productos_structure(self):
         """Test: GET /api/kpi/productos/ retorna estructura correcta"""
         response = self.client.get('/api/kpi/productos/')
-        data = json.loads(response.content)
+        data = self._parse(response)
         
         # Verificar secciones principales
-        self.assertIn('ventas', data)
-        self.assertIn('inventario', data)
-        self.assertIn('metadata', data)
+        self.assertKeys(data, {'ventas', 'inventario', 'metadata'})
         
         # Verificar subsecciones de ventas
-        self.assertIn('top_vendidos', data['ventas'])
-        self.assertIn('rentabilidad', data['ventas'])
-        self.assertIn('abc_analysis', data['ventas'])
+        self.assertKeys(data['ventas'], {'top_vendidos', 'rentabilidad', 'abc_analysis'})
         
         # Verificar subsecciones de inventario
-        self.assertIn('rotacion', data['inventario'])
+        self.assertKeys(data['inventario'], {'rotacion'})
     
     def test_api_kpi_productos_validates_dias_param(self):
         """Test: API valida parámetro dias"""
         # Valores válidos
         for dias in [7, 30, 90, 180, 365]:
-            response = self.client.get(f'/api/kpi/productos/?dias={dias}')
-            self.assertEqual(response.status_code, 200)
+            with self.subTest(dias=dias):
+                response = self.client.get(f'/api/kpi/productos/?dias={dias}')
+                self.assertEqual(response.status_code, 200)
         
         # Valor inválido
         response = self.client.get('/api/kpi/productos/?dias=999')
@@ -283,8 +373,9 @@ class KPIAPITestCase(TestCase):
         """Test: API valida parámetro limit"""
         # Valores válidos
         for limit in [1, 5, 10, 20]:
-            response = self.client.get(f'/api/kpi/productos/?limit={limit}')
-            self.assertEqual(response.status_code, 200)
+            with self.subTest(limit=limit):
+                response = self.client.get(f'/api/kpi/productos/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
         
         # Valor inválido (fuera de rango 1-20)
         response = self.client.get('/api/kpi/productos/?limit=100')
@@ -293,6 +384,16 @@ class KPIAPITestCase(TestCase):
         response = self.client.get('/api/kpi/productos/?limit=0')
         self.assertEqual(response.status_code, 400)
     
+    def test_api_kpi_productos_cached_per_params(self):
+        """Test: La respuesta se cachea por combinación de parámetros"""
+        with patch.object(KPIService, 'get_top_productos', return_value=[]) as mock_top:
+            self.client.get('/api/kpi/productos/?dias=30&limit=5')
+            self.client.get('/api/kpi/productos/?dias=30&limit=5')
+            self.assertEqual(mock_top.call_count, 1)
+            
+            self.client.get('/api/kpi/productos/?dias=90&limit=5')
+            self.assertEqual(mock_top.call_count, 2)
+    
     # =========================================================================
     # Tests de Endpoint /api/kpi/productos/abc/
     # =========================================================================
@@ -305,11 +406,27 @@ class KPIAPITestCase(TestCase):
     def test_api_kpi_abc_detalle_structure(self):
         """Test: GET /api/kpi/productos/abc/ retorna estructura correcta"""
         response = self.client.get('/api/kpi/productos/abc/')
-        data = json.loads(response.content)
-        
-        self.assertIn('productos', data)
-        self.assertIn('resumen', data)
-        self.assertIn('metadata', data)
+        data = self._parse(response)
+        
+        self.assertKeys(data, {'productos', 'resumen', 'metadata'})
+    
+    def test_api_kpi_abc_detalle_usa_cache_page(self):
+        """Test: /api/kpi/productos/abc/ responde con Content-Length y sirve la repetición desde caché"""
+        resultado = {
+            'productos': [{'id': i, 'codigo': f'ABC-{i}', 'ganancia_total': 1.5} for i in range(3)],
+            'resumen': {'clase_a': {'cantidad': 3, 'ganancia_total': 4.5, 'porcentaje': 100.0}}
+        }
+        with patch.object(KPIService, 'get_productos_abc_analysis', return_value=resultado) as mock_abc:
+            response = self.client.get('/api/kpi/productos/abc/?dias=90')
+            cacheada = self.client.get('/api/kpi/productos/abc/?dias=90')
+        data = self._parse(response)
+        
+        self.assertFalse(response.streaming)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(cacheada.content, response.content)
+        self.assertEqual(mock_abc.call_count, 1)
+        self.assertEqual(data['productos'], resultado['productos'])
+        self.assertEqual(data['metadata']['periodo_dias'], 90)
     
     # =========================================================================
     # Tests de Endpoint /api/kpi/invalidar-cache/
@@ -321,7 +438,7 @@ class KPIAPITestCase(TestCase):
         
         self.assertEqual(response.status_code, 200)
         
-        data = json.loads(response.content)
+        data = self._parse(response)
         self.assertTrue(data.get('success'))
     
     # =========================================================================
@@ -344,9 +461,8 @@ class KPICacheTestCase(TestCase):
     """Tests para verificar comportamiento de caché de KPIs"""
     
     def setUp(self):
-        """Limpiar caché antes de cada test"""
-        from django.core.cache import cache
-        cache.clear()
+        """Limpiar caché de KPIs antes de cada test"""
+        KPIService.clear_all_kpi_cache()
     
     def test_kpi_uses_cache(self):
         """Test: KPIService usa caché correctamente"""
@@ -372,3 +488,36 @@ class KPICacheTestCase(TestCase):
         # No debe haber error al volver a llamar
         result = KPIService.get_ticket_promedio()
         self.assertIsInstance(result, dict)
+    
+    def test_clear_kpi_cache_invalida_version_y_respeta_otras_claves(self):
+        """Test: clear_all_kpi_cache cambia la versión kpi:* y no toca otras claves"""
+        from django.core.cache import cache
+        
+        cache.set('otra:clave', 'valor')
+        resultado = KPIService.get_ticket_promedio(dias=30)
+        self.assertEqual(KPIService._cache_get('ticket_promedio:dias:30')[2], resultado)
+        
+        KPIService.clear_all_kpi_cache()
+        
+        self.assertIsNone(KPIService._cache_get('ticket_promedio:dias:30')[2])
+        self.assertEqual(cache.get('otra:clave'), 'valor')
+    
+    def test_version_expulsada_no_revive_entradas_anteriores(self):
+        """Test: si la versión se pierde, las entradas previas no se sirven como vigentes"""
+        from django.core.cache import cache
+        
+        KPIService.get_ticket_promedio(dias=30)
+        cache.delete(KPIService.CACHE_VERSION_KEY)
+        
+        clave, version, cached = KPIService._cache_get('ticket_promedio:dias:30')
+        self.assertIsNone(cached)
+        self.assertGreater(version, 1)
+    
+    def test_clear_kpi_cache_sin_version_previa(self):
+        """Test: clear_all_kpi_cache funciona aunque la versión haya expirado"""
+        from django.core.cache import cache
+        
+        cache.delete(KPIService.CACHE_VERSION_KEY)
+        KPIService.clear_all_kpi_cache()
+        
+        self.assertIsNotNone(cache.get(KPIService.CACHE_VERSION_KEY))